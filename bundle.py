@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+MCPM Bundles - Offline export/import of installed servers
+Copyright 2024 James Dominguez
+Licensed under the Apache License, Version 2.0
+
+A bundle is an uncompressed tar archive:
+
+    manifest.json           servers, artifacts (with sha256) and config fragment
+    npm/<server>.tar        the installed global package, node_modules included
+    docker/<server>.tar     `docker save` output
+    git/<server>.bundle     `git bundle create --all` output
+    wheels/<file>.whl       cached wheels the git servers' venvs are built from
+
+npm artifacts are snapshots of the installed package directory rather than
+`npm pack` tarballs because a packed tarball leaves out the dependencies,
+which an air-gapped machine has no way to fetch. Wheels are seeded into the
+importing machine's wheel cache before any git server is restored, so its
+virtualenv builds offline.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Optional
+
+import scheduler
+
+if TYPE_CHECKING:
+    from mcpm import MCPPackageManager
+
+logger = logging.getLogger("mcpm.bundle")
+
+BUNDLE_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _safe(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", name)
+
+
+def _safe_extract(tar: tarfile.TarFile, dest: Path):
+    """Extract without letting any member, link or link target land outside dest"""
+    if hasattr(tarfile, "data_filter"):
+        tar.extractall(dest, filter="data")
+        return
+    root = os.path.realpath(dest)
+
+    def inside(path: str) -> bool:
+        return os.path.commonpath([root, path]) == root
+
+    for member in tar.getmembers():
+        path = os.path.normpath(os.path.join(root, member.name))
+        if not inside(path):
+            raise ValueError(f"unsafe path in bundle: {member.name}")
+        if member.issym():
+            link = os.path.normpath(os.path.join(os.path.dirname(path), member.linkname))
+        elif member.islnk():
+            link = os.path.normpath(os.path.join(root, member.linkname))
+        elif member.isfile() or member.isdir():
+            continue
+        else:
+            raise ValueError(f"unsupported member in bundle: {member.name}")
+        if os.path.isabs(member.linkname) or not inside(link):
+            raise ValueError(f"link escapes the bundle: {member.name} -> {member.linkname}")
+    tar.extractall(dest)
+
+
+class BundleManager:
+    """Export installed servers to a bundle and restore them without network
+
+    ``mcpm`` is the MCPPackageManager whose installed DB, subprocess runner
+    and config manager are used; ``home`` is its MCPM_HOME and
+    ``wheel_cache`` its shared wheel cache.
+    """
+
+    def __init__(self, mcpm: "MCPPackageManager", home: Path, wheel_cache: Optional[Path] = None):
+        self.mcpm = mcpm
+        self.home = Path(home)
+        self.wheel_cache = Path(wheel_cache) if wheel_cache else self.home / "cache" / "wheels"
+
+    @scheduler.at_priority(scheduler.BULK)
+    async def export(self, path: str, names: Optional[list[str]] = None) -> dict[str, Any]:
+        """Write the selected (default: all) installed servers to one archive"""
+        await self.mcpm._load_installed()
+        selected = names or sorted(self.mcpm.installed)
+        missing = [n for n in selected if n not in self.mcpm.installed]
+        if missing:
+            return {"error": f"Not installed: {', '.join(missing)}"}
+
+        configured = (await self.mcpm.config_manager.load_config()).get("mcpServers", {})
+        with tempfile.TemporaryDirectory(prefix="mcpm-bundle-") as tmp:
+            staging = Path(tmp)
+            outcomes = await asyncio.gather(
+                *(self._export_artifact(n, self.mcpm.installed[n], staging) for n in selected)
+            )
+            errors = {n: o["error"] for n, o in zip(selected, outcomes) if "error" in o}
+            if errors:
+                return {"error": "Failed to export artifacts", "errors": errors}
+            artifacts = [o for o in outcomes if o.get("path")]
+            wheels = await asyncio.to_thread(self._stage_wheels, selected, staging)
+            for artifact in (*artifacts, *wheels):
+                artifact["sha256"] = await asyncio.to_thread(_sha256, staging / artifact["path"])
+                artifact["size"] = (staging / artifact["path"]).stat().st_size
+
+            manifest = {
+                "bundleVersion": BUNDLE_VERSION,
+                "created": datetime.now().isoformat(),
+                "servers": {n: self.mcpm.installed[n] for n in selected},
+                "artifacts": artifacts,
+                "wheels": wheels,
+                "config": {n: configured[n] for n in selected if n in configured},
+            }
+            (staging / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2))
+            await asyncio.to_thread(self._write_archive, Path(path), staging, [*artifacts, *wheels])
+
+        return {
+            "status": "exported",
+            "path": str(path),
+            "servers": selected,
+            "artifacts": len(artifacts),
+            "wheels": len(wheels),
+            "bytes": Path(path).stat().st_size,
+        }
+
+    @staticmethod
+    def _write_archive(path: Path, staging: Path, artifacts: list[dict[str, Any]]):
+        # Manifest first so import can plan before reading any artifact
+        with tarfile.open(path, "w") as tar:
+            tar.add(staging / MANIFEST_NAME, arcname=MANIFEST_NAME)
+            for artifact in artifacts:
+                tar.add(staging / artifact["path"], arcname=artifact["path"])
+
+    def _stage_wheels(self, selected: list[str], staging: Path) -> list[dict[str, Any]]:
+        """Copy the cached wheels the selected git servers' venvs need"""
+        needed: set[Path] = set()
+        for name in selected:
+            info = self.mcpm.installed[name]
+            if info.get("method") == "git":
+                needed.update(self.mcpm._venv_wheels(info.get("details", {})))
+        if needed:
+            (staging / "wheels").mkdir()
+        for wheel in needed:
+            shutil.copyfile(wheel, staging / "wheels" / wheel.name)
+        return [{"path": f"wheels/{wheel.name}"} for wheel in sorted(needed)]
+
+    async def _export_artifact(
+        self, name: str, info: dict[str, Any], staging: Path
+    ) -> dict[str, Any]:
+        details = info.get("details", {})
+        method = info.get("method")
+        run = self.mcpm._run
+        if method == "npm":
+            code, stdout, stderr = await run("npm", "root", "-g")
+            package_dir = Path(stdout.decode().strip()) / details.get("package", "")
+            if code != 0 or not package_dir.is_dir():
+                return {"error": f"npm package {details.get('package')} not found"}
+            rel = f"npm/{_safe(name)}.tar"
+            (staging / "npm").mkdir(exist_ok=True)
+
+            def pack():
+                with tarfile.open(staging / rel, "w") as tar:
+                    tar.add(package_dir, arcname="package")
+
+            await asyncio.to_thread(pack)
+        elif method == "docker":
+            rel = f"docker/{_safe(name)}.tar"
+            (staging / "docker").mkdir(exist_ok=True)
+            code, _, stderr = await run("docker", "save", "-o", str(staging / rel), details["image"])
+            if code != 0:
+                return {"error": stderr.decode()}
+        elif method == "git":
+            rel = f"git/{_safe(name)}.bundle"
+            (staging / "git").mkdir(exist_ok=True)
+            code, _, stderr = await run(
+                "git", "-C", details["path"], "bundle", "create", str(staging / rel), "--all"
+            )
+            if code != 0:
+                return {"error": stderr.decode()}
+        else:
+            return {}
+        return {"server": name, "kind": method, "path": rel}
+
+    @scheduler.at_priority(scheduler.BULK)
+    async def import_(self, path: str, configure: bool = True) -> dict[str, Any]:
+        """Restore a bundle; artifacts already present on this machine are skipped"""
+        try:
+            with tarfile.open(path, "r") as tar:
+                manifest = json.load(tar.extractfile(MANIFEST_NAME))
+        except (OSError, KeyError, ValueError, tarfile.TarError) as e:
+            return {"error": f"Not a readable bundle: {e}"}
+        if manifest.get("bundleVersion") != BUNDLE_VERSION:
+            return {"error": f"Unsupported bundle version {manifest.get('bundleVersion')}"}
+
+        await self.mcpm._load_installed()
+        servers = manifest["servers"]
+        artifacts = {a["server"]: a for a in manifest.get("artifacts", [])}
+        present = await self._present(servers)
+        needed = [a for name, a in artifacts.items() if name not in present]
+        wheels = []
+        if any(a["kind"] == "git" for a in needed):
+            wheels = [
+                w
+                for w in manifest.get("wheels", [])
+                if not (self.wheel_cache / Path(w["path"]).name).exists()
+            ]
+
+        result: dict[str, Any] = {
+            "restored": [],
+            "skipped": sorted(present),
+            "errors": {},
+        }
+        staging_root = self.home / "bundles"
+        staging_root.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(prefix="import-", dir=staging_root) as tmp:
+            staging = Path(tmp)
+            await asyncio.to_thread(self._extract, Path(path), staging, [*needed, *wheels])
+            bad = [
+                a
+                for a in (*needed, *wheels)
+                if not (staging / a["path"]).is_file()
+                or await asyncio.to_thread(_sha256, staging / a["path"]) != a["sha256"]
+            ]
+            for artifact in bad:
+                key = artifact.get("server", artifact["path"])
+                result["errors"][key] = "artifact missing or sha256 mismatch"
+            good = [a for a in needed if a not in bad]
+            # Before any git restore, so the venvs build from the cache
+            seeded = [w for w in wheels if w not in bad]
+            if seeded:
+                self.wheel_cache.mkdir(parents=True, exist_ok=True)
+            for wheel in seeded:
+                shutil.move(staging / wheel["path"], self.wheel_cache / Path(wheel["path"]).name)
+            result["wheels"] = len(seeded)
+
+            outcomes = await asyncio.gather(
+                *(self._restore(a, servers[a["server"]], staging) for a in good)
+            )
+
+        for artifact, outcome in zip(good, outcomes):
+            name = artifact["server"]
+            if "error" in outcome:
+                result["errors"][name] = outcome["error"]
+                continue
+            self.mcpm.installed[name] = {"method": outcome["method"], "details": outcome}
+            self.mcpm._record_artifact(outcome)
+            result["restored"].append(name)
+        # Entries without artifacts (and already present ones) just need recording
+        for name, info in servers.items():
+            if name in self.mcpm.installed or (name in artifacts and name not in present):
+                continue
+            if info.get("method") == "git":
+                info = {**info, "details": {**info["details"], "path": str(self.home / "repos" / name)}}
+            self.mcpm.installed[name] = info
+        await self.mcpm._save_installed()
+
+        if configure:
+            upserts = {}
+            for name, entry in manifest.get("config", {}).items():
+                if name not in self.mcpm.installed:
+                    continue
+                details = self.mcpm.installed[name]["details"]
+                if details.get("method") == "git":
+                    # Paths differ between machines; regenerate around the local checkout
+                    entry = self.mcpm.config_manager.generate_server_config(details)
+                upserts[name] = entry
+            if upserts:
+                await self.mcpm.config_manager.apply_changes(upserts, [])
+            result["configured"] = sorted(upserts)
+        return result
+
+    async def _present(self, servers: dict[str, Any]) -> set[str]:
+        """Servers whose artifact this machine already has, checked in batches"""
+        npm = {n: i["details"] for n, i in servers.items() if i.get("method") == "npm"}
+        docker = {n: i["details"] for n, i in servers.items() if i.get("method") == "docker"}
+        git = {n: i["details"] for n, i in servers.items() if i.get("method") == "git"}
+
+        async def nothing() -> dict:
+            return {}
+
+        versions, images, *heads = await asyncio.gather(
+            self.mcpm._npm_global_versions() if npm else nothing(),
+            self.mcpm._inspect_docker_images([d["image"] for d in docker.values()])
+            if docker
+            else nothing(),
+            *(self.mcpm._git_head(self.home / "repos" / n) for n in git),
+        )
+        present = {
+            n
+            for n, d in npm.items()
+            if d.get("package") in versions
+            and (not d.get("version") or versions[d["package"]] == d["version"])
+        }
+        present |= {n for n, d in docker.items() if d.get("image") in images}
+        present |= {
+            n for (n, d), head in zip(git.items(), heads) if head and head == d.get("commit", head)
+        }
+        return present
+
+    @staticmethod
+    def _extract(path: Path, staging: Path, needed: list[dict[str, Any]]):
+        wanted = {a["path"] for a in needed}
+        with tarfile.open(path, "r") as tar:
+            for member in tar:
+                if member.name in wanted and member.isfile():
+                    target = staging / member.name
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    with tar.extractfile(member) as src, open(target, "wb") as dst:
+                        shutil.copyfileobj(src, dst)
+
+    async def _restore(
+        self, artifact: dict[str, Any], info: dict[str, Any], staging: Path
+    ) -> dict[str, Any]:
+        name, kind = artifact["server"], artifact["kind"]
+        details = dict(info.get("details", {}))
+        source = staging / artifact["path"]
+        run = self.mcpm._run
+        if kind == "npm":
+            # Keep the unpacked package (deps included) where npm can link it from
+            package_dir = self.home / "npm-packages" / _safe(name)
+            shutil.rmtree(package_dir, ignore_errors=True)
+            package_dir.parent.mkdir(parents=True, exist_ok=True)
+
+            unpacked = package_dir.parent / f".{package_dir.name}"
+
+            def unpack():
+                shutil.rmtree(unpacked, ignore_errors=True)
+                try:
+                    with tarfile.open(source, "r") as tar:
+                        _safe_extract(tar, unpacked)
+                    (unpacked / "package").rename(package_dir)
+                finally:
+                    shutil.rmtree(unpacked, ignore_errors=True)
+
+            try:
+                await asyncio.to_thread(unpack)
+            except Exception as e:
+                return {"error": f"Failed to unpack npm artifact: {e}"}
+            code, _, stderr = await run("npm", "install", "-g", "--offline", str(package_dir))
+            details["package_dir"] = str(package_dir)
+        elif kind == "docker":
+            code, _, stderr = await run("docker", "load", "-i", str(source))
+        elif kind == "git":
+            target = self.home / "repos" / name
+            shutil.rmtree(target, ignore_errors=True)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            code, _, stderr = await run("git", "clone", str(source), str(target))
+            if code != 0:
+                return {"error": stderr.decode()}
+            repo = details.get("repo", str(source))
+            await run("git", "-C", str(target), "remote", "set-url", "origin", repo)
+            # Paths and the venv belong to the exporting machine; rebuild them locally
+            details = await self.mcpm._describe_checkout(name, repo, target)
+            if "venv_error" in details:
+                return {"error": f"virtualenv: {details['venv_error']}"}
+        else:
+            return {"error": f"Unknown artifact kind {kind}"}
+        if code != 0:
+            return {"error": stderr.decode()}
+        details["bundle_sha256"] = artifact["sha256"]
+        return details
@@ -5,28 +5,63 @@ Copyright 2024 James Dominguez
 Licensed under the Apache License, Version 2.0
 """
 
+import asyncio
+import hashlib
 import json
 import logging
 import os
 import platform
+import re
 import shutil
+import tempfile
+from collections.abc import AsyncIterator, Awaitable
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Callable, Optional
+
+import tracing
 
 logger = logging.getLogger("mcpm.config")
 
+DEFAULT_TARGET = "claude-desktop"
+_DEFAULT_BACKUP_RE = re.compile(r"^config_backup_\d{8}_\d{6}(_\d{6})?\.json$")
+
+
+def target_slug(target: str) -> str:
+    """Filename-safe name for a target; path targets get a hash to stay unique"""
+    if re.fullmatch(r"[A-Za-z0-9_.-]+", target) and target not in (".", ".."):
+        return target
+    readable = re.sub(r"[^A-Za-z0-9_.-]+", "_", target).strip("_.")[-40:]
+    return f"{readable}-{hashlib.sha256(target.encode()).hexdigest()[:12]}"
+
 
 class MCPConfigManager:
     """Manages MCP configuration files across different platforms"""
 
-    def __init__(self):
-        self.config_path = self._find_config_path()
+    def __init__(
+        self,
+        cache: bool = False,
+        config_path: Optional[Path] = None,
+        target: str = DEFAULT_TARGET,
+    ):
+        self.target = target
+        self.config_path = Path(config_path) if config_path else self._find_config_path()
         self.config: dict[str, Any] = {}
-        self.backup_dir = Path.home() / ".mcpm" / "backups"
+        # With cache on, the parsed config is reused until invalidate() is called
+        self.cache = cache
+        self._loaded = False
+        # Each target keeps its own backups so a restore can't cross clients;
+        # the default target uses the top level, where older backups live
+        self.backup_root = Path.home() / ".mcpm" / "backups"
+        self.backup_dir = (
+            self.backup_root
+            if target == DEFAULT_TARGET
+            else self.backup_root / "targets" / target_slug(target)
+        )
         self.backup_dir.mkdir(exist_ok=True, parents=True)
 
-    def _find_config_path(self) -> Optional[Path]:
+    @staticmethod
+    def _find_config_path() -> Optional[Path]:
         """Find the MCP config file based on platform"""
         possible_paths = []
 
@@ -83,41 +118,73 @@ class MCPConfigManager:
         logger.info(f"No config found, will create at: {default}")
         return default
 
+    def invalidate(self) -> None:
+        """Forget the cached config so the next load re-reads the file"""
+        self._loaded = False
+
+    @tracing.traced("config.load")
     async def load_config(self) -> dict[str, Any]:
         """Load the current MCP configuration"""
+        if self.cache and self._loaded:
+            return self.config
+
         if not self.config_path or not self.config_path.exists():
             logger.info("No existing config file, starting with empty config")
-            return {"mcpServers": {}}
+            self.config = {"mcpServers": {}}
+            self._loaded = True
+            return self.config
 
         try:
-            with open(self.config_path) as f:
-                self.config = json.load(f)
+            self.config = await asyncio.to_thread(self._read_config)
 
             # Ensure mcpServers key exists
             if "mcpServers" not in self.config:
                 self.config["mcpServers"] = {}
 
+            self._loaded = True
             return self.config
         except Exception as e:
             logger.error(f"Failed to load config: {e}")
             raise Exception(f"Failed to load MCP config: {e}")
 
+    def _read_config(self) -> dict[str, Any]:
+        with open(self.config_path) as f:
+            return json.load(f)
+
+    def _write_config(self, config: dict[str, Any]) -> None:
+        """Write via a temp file and rename so readers never see a partial config"""
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=f".{self.config_path.name}.", dir=self.config_path.parent
+        )
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(config, f, indent=2)
+            if self.config_path.exists():
+                shutil.copymode(self.config_path, tmp_path)
+            os.replace(tmp_path, self.config_path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+    @tracing.traced("config.backup")
     async def backup_config(self) -> str:
         """Create a backup of the current config"""
         if not self.config_path or not self.config_path.exists():
             return "No config to backup"
 
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        # Microseconds keep a restore's safety backup from overwriting its source
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
         backup_path = self.backup_dir / f"config_backup_{timestamp}.json"
 
         try:
-            shutil.copy2(self.config_path, backup_path)
+            await asyncio.to_thread(shutil.copy2, self.config_path, backup_path)
             logger.info(f"Created backup at: {backup_path}")
             return str(backup_path)
         except Exception as e:
             logger.error(f"Failed to backup config: {e}")
             raise Exception(f"Failed to backup config: {e}")
 
+    @tracing.traced("config.save")
     async def save_config(self) -> None:
         """Save the current configuration"""
         if not self.config_path:
@@ -128,8 +195,8 @@ class MCPConfigManager:
 
         try:
             # Write with pretty formatting
-            with open(self.config_path, "w") as f:
-                json.dump(self.config, f, indent=2)
+            await asyncio.to_thread(self._write_config, self.config)
+            self._loaded = True
             logger.info(f"Saved config to: {self.config_path}")
         except Exception as e:
             logger.error(f"Failed to save config: {e}")
@@ -185,28 +252,57 @@ class MCPConfigManager:
             "backup": backup_path,
         }
 
-    async def list_configured(self) -> list[dict[str, Any]]:
-        """List all configured servers"""
+    async def apply_changes(
+        self, upserts: dict[str, dict[str, Any]], removals: list[str]
+    ) -> dict[str, Any]:
+        """Add/replace and remove several servers with a single backup and write"""
         await self.load_config()
 
-        servers = []
-        for name, config in self.config.get("mcpServers", {}).items():
-            servers.append(
-                {
-                    "name": name,
-                    "command": config.get("command", ""),
-                    "args": config.get("args", []),
-                    "env": config.get("env", {}),
-                }
-            )
+        backup_path = await self.backup_config()
+
+        if "mcpServers" not in self.config:
+            self.config["mcpServers"] = {}
+
+        servers = self.config["mcpServers"]
+        for name in removals:
+            servers.pop(name, None)
+        servers.update(upserts)
+
+        await self.save_config()
+
+        return {
+            "status": "applied",
+            "upserted": sorted(upserts),
+            "removed": sorted(removals),
+            "backup": backup_path,
+            "config_path": str(self.config_path),
+        }
 
-        return servers
+    async def list_configured(self) -> list[dict[str, Any]]:
+        """List all configured servers"""
+        return [server async for server in self.iter_configured()]
+
+    async def iter_configured(self) -> AsyncIterator[dict[str, Any]]:
+        """Yield configured servers one at a time"""
+        servers = (await self.load_config()).get("mcpServers", {})
+        # Iterate over a snapshot of the names: the config may be reloaded between yields
+        for name in list(servers):
+            config = servers.get(name)
+            if config is None:
+                continue
+            yield {
+                "name": name,
+                "command": config.get("command", ""),
+                "args": config.get("args", []),
+                "env": config.get("env", {}),
+            }
 
     async def get_server_config(self, name: str) -> Optional[dict[str, Any]]:
         """Get configuration for a specific server"""
         await self.load_config()
         return self.config.get("mcpServers", {}).get(name)
 
+    @tracing.traced("config.restore")
     async def restore_backup(self, backup_name: str) -> dict[str, Any]:
         """Restore a configuration backup"""
         backup_path = self.backup_dir / backup_name
@@ -216,6 +312,8 @@ class MCPConfigManager:
             backup_path = Path(backup_name)
             if not backup_path.exists():
                 return {"error": f"Backup not found: {backup_name}"}
+        if not self._owns_backup(backup_path):
+            return {"error": f"Backup {backup_name} belongs to another config target"}
 
         try:
             # Backup current config first
@@ -225,6 +323,7 @@ class MCPConfigManager:
             shutil.copy2(backup_path, self.config_path)
 
             # Reload config
+            self.invalidate()
             await self.load_config()
 
             return {
@@ -235,22 +334,38 @@ class MCPConfigManager:
         except Exception as e:
             return {"error": f"Failed to restore backup: {e}"}
 
+    def _is_own_backup_name(self, name: str) -> bool:
+        # Older versions kept every target's backups at the top level, suffixed
+        return self.target != DEFAULT_TARGET or bool(_DEFAULT_BACKUP_RE.match(name))
+
+    def _owns_backup(self, path: Path) -> bool:
+        """Whether a backup file may be restored into this target's config"""
+        path = path.resolve()
+        root = self.backup_root.resolve()
+        if path.parent == self.backup_dir.resolve():
+            return self._is_own_backup_name(path.name)
+        # Files outside the backup tree are the user's explicit choice
+        return root not in path.parents
+
     async def list_backups(self) -> list[dict[str, Any]]:
         """List all available backups"""
-        backups = []
+        return [backup async for backup in self.iter_backups()]
 
+    async def iter_backups(self) -> AsyncIterator[dict[str, Any]]:
+        """Yield backups newest first, statting each only when it's reached"""
         for backup_file in sorted(self.backup_dir.glob("config_backup_*.json"), reverse=True):
-            stat = backup_file.stat()
-            backups.append(
-                {
-                    "name": backup_file.name,
-                    "path": str(backup_file),
-                    "size": stat.st_size,
-                    "modified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                }
-            )
-
-        return backups
+            if not self._is_own_backup_name(backup_file.name):
+                continue
+            try:
+                stat = backup_file.stat()
+            except FileNotFoundError:
+                continue
+            yield {
+                "name": backup_file.name,
+                "path": str(backup_file),
+                "size": stat.st_size,
+                "modified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+            }
 
     def generate_server_config(self, server_info: dict[str, Any]) -> dict[str, Any]:
         """Generate appropriate config for a server based on its installation method"""
@@ -264,12 +379,121 @@ class MCPConfigManager:
             return {"command": "docker", "args": ["run", "-i", "--rm", image]}
         elif method == "git":
             repo_path = server_info.get("path", "")
-            # Assume there's a main script
+            # Assume there's a main script, run by the server's own venv when it has one
             return {
-                "command": "python",
+                "command": server_info.get("python", "python"),
                 "args": [f"{repo_path}/server.py"],
                 "env": {"PYTHONPATH": repo_path},
             }
         else:
             # Generic config
             return {"command": "echo", "args": ["Server needs manual configuration"]}
+
+
+def known_client_configs() -> dict[str, Path]:
+    """Config file locations of the MCP clients mcpm knows about"""
+    home = Path.home()
+    return {
+        DEFAULT_TARGET: MCPConfigManager._find_config_path(),
+        "cursor": home / ".cursor" / "mcp.json",
+        "windsurf": home / ".codeium" / "windsurf" / "mcp_config.json",
+    }
+
+
+class ConfigTargets:
+    """The set of MCP config files mcpm manages
+
+    Known client locations are discovered automatically; extra ones (other
+    clients, profiles, project configs) are registered by name in
+    ``~/.mcpm/targets.json``.
+    """
+
+    def __init__(self):
+        self.registry_path = Path.home() / ".mcpm" / "targets.json"
+
+    def registered(self) -> dict[str, Path]:
+        """User-registered targets"""
+        try:
+            data = json.loads(self.registry_path.read_text())
+        except (OSError, ValueError):
+            return {}
+        return {name: Path(path).expanduser() for name, path in data.items()}
+
+    def _save_registered(self, targets: dict[str, Path]) -> None:
+        self.registry_path.parent.mkdir(exist_ok=True, parents=True)
+        self.registry_path.write_text(
+            json.dumps({name: str(path) for name, path in targets.items()}, indent=2)
+        )
+
+    def register(self, name: str, path: str) -> dict[str, Any]:
+        """Add a named config file to the managed set"""
+        if name in known_client_configs() or name == "all":
+            return {"error": f"Target name '{name}' is reserved"}
+        targets = self.registered()
+        targets[name] = Path(path).expanduser().absolute()
+        self._save_registered(targets)
+        return {"status": "registered", "target": name, "config_path": str(targets[name])}
+
+    def unregister(self, name: str) -> dict[str, Any]:
+        """Drop a registered target (the config file itself is left alone)"""
+        targets = self.registered()
+        if name not in targets:
+            return {"error": f"Target '{name}' not registered"}
+        del targets[name]
+        self._save_registered(targets)
+        return {"status": "unregistered", "target": name}
+
+    def all(self) -> dict[str, Path]:
+        """Every target: known client configs followed by registered ones"""
+        return {**known_client_configs(), **self.registered()}
+
+    def discover(self) -> list[dict[str, Any]]:
+        """List all targets and whether their config file exists yet"""
+        return [
+            {"target": name, "config_path": str(path), "exists": path.exists()}
+            for name, path in self.all().items()
+        ]
+
+    def select(self, names: list[str]) -> dict[str, MCPConfigManager]:
+        """Resolve target names or config paths into managers
+
+        ``all`` expands to the default target plus every other target whose
+        config file already exists, so clients that aren't installed are not
+        given a config they never asked for.
+        """
+        targets = self.all()
+        selected: dict[str, Path] = {}
+        for name in names:
+            if name == "all":
+                selected.update(
+                    (n, p) for n, p in targets.items() if n == DEFAULT_TARGET or p.exists()
+                )
+            elif name in targets:
+                selected[name] = targets[name]
+            else:
+                path = Path(name).expanduser().absolute()
+                selected[str(path)] = path
+        return {
+            name: MCPConfigManager(config_path=path, target=name)
+            for name, path in selected.items()
+        }
+
+
+async def apply_to_targets(
+    managers: dict[str, MCPConfigManager],
+    operation: Callable[[MCPConfigManager], Awaitable[Any]],
+) -> dict[str, Any]:
+    """Run an operation against several targets concurrently
+
+    A failure in one target is reported in its slot and does not stop the
+    others.
+    """
+
+    async def run(manager: MCPConfigManager) -> Any:
+        try:
+            return await operation(manager)
+        except Exception as e:
+            return {"error": str(e)}
+
+    results = await asyncio.gather(*(run(manager) for manager in managers.values()))
+    return dict(zip(managers, results))
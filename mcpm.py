@@ -20,16 +20,30 @@ limitations under the License.
 """
 
 import asyncio
+import base64
 import json
 import logging
-import subprocess
+import os
+import re
+import shutil
 import sys
+import zipfile
+from collections.abc import AsyncIterator, MutableMapping
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Optional, TypeVar
 
 import aiohttp
 
-from config_manager import MCPConfigManager
+import scheduler
+import tracing
+from bundle import BundleManager
+from config_manager import ConfigTargets, MCPConfigManager, apply_to_targets
+from npm_registry import PackumentCache, parse_version, resolve
+from registry_store import RegistryStore, haystack
+from watcher import FileWatcher
+
+__version__ = "0.1.5"
+MCP_PROTOCOL_VERSION = "2024-11-05"
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("mcpm")
@@ -39,15 +53,211 @@ REGISTRY_URL = "https://registry.npmjs.org/-/v1/search?text=scope:modelcontextpr
 MCPM_HOME = Path.home() / ".mcpm"
 INSTALLED_DB = MCPM_HOME / "installed.json"
 CACHE_DIR = MCPM_HOME / "cache"
+ARTIFACTS_DB = MCPM_HOME / "artifacts.json"
+VENVS_DIR = MCPM_HOME / "venvs"
+WHEEL_CACHE = CACHE_DIR / "wheels"
+REGISTRY_STORE = CACHE_DIR / "registry.bin"
+# JSON snapshot written by earlier versions, migrated on first load
+REGISTRY_SNAPSHOT = CACHE_DIR / "registry.json"
+REGISTRY_FEED_ENV = "MCPM_REGISTRY_FEED"
+PACKUMENT_CACHE = CACHE_DIR / "packuments"
+LOCKFILE_NAME = "mcpm-lock.json"
+LOCKFILE_VERSION = 1
+# Exact facts a lockfile pins per backend: npm version/integrity, docker digest, git commit
+LOCK_PINS = ("version", "integrity", "digest", "commit")
+# Files that mark a git checkout as a Python server worth a virtualenv
+PYTHON_PROJECT_MARKERS = ("requirements.txt", "pyproject.toml", "setup.py", "server.py")
+# install method -> (artifacts.json section, details key naming the global artifact)
+ARTIFACT_KEYS = {"npm": ("npm", "package"), "docker": ("docker", "image")}
+# What pip builds a project with when pyproject.toml doesn't say (PEP 517 fallback)
+DEFAULT_BUILD_REQUIRES = ["setuptools>=40.8.0", "wheel"]
+
+# Garbage collection knobs
+CACHE_BUDGET_ENV = "MCPM_CACHE_BUDGET"
+# Server mode: emit tools/list_changed notifications when watched files change
+WATCH_NOTIFY_ENV = "MCPM_WATCH_NOTIFY"
+AUTO_GC_ENV = "MCPM_AUTO_GC"
+# Paged listings: default and maximum items per page
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def split_spec(target: str) -> tuple[str, Optional[str]]:
+    """Split 'name@range' into ('name', 'range'); plain names get None"""
+    name, sep, spec = target.rpartition("@")
+    if not sep or not name:
+        return target, None
+    return name, spec or None
+
+
+def parse_size(value: str) -> int:
+    """Parse a human size like '512M' or '2G' into bytes; ValueError if malformed"""
+    text = value.strip().upper().removesuffix("B").removesuffix("I")
+    unit = text[-1:] if text[-1:] in _SIZE_UNITS else ""
+    number = text[: len(text) - len(unit)].strip()
+    try:
+        size = float(number)
+    except ValueError:
+        raise ValueError(f"Invalid size: {value!r} (expected e.g. 512M or 2G)") from None
+    if not 0 <= size < float("inf"):
+        raise ValueError(f"Invalid size: {value!r} (expected e.g. 512M or 2G)")
+    return int(size * _SIZE_UNITS[unit])
+
+
+T = TypeVar("T")
+
+
+async def aslice(
+    items: AsyncIterator[T], offset: int = 0, limit: Optional[int] = None
+) -> AsyncIterator[T]:
+    """itertools.islice for async iterators: skip ``offset`` items, yield at most ``limit``"""
+    index = 0
+    try:
+        async for item in items:
+            if limit is not None and index >= offset + limit:
+                break
+            if index >= offset:
+                yield item
+            index += 1
+    finally:
+        await items.aclose()
+
+
+async def _collect(items: AsyncIterator[T]) -> list[T]:
+    return [item async for item in items]
+
+
+def encode_cursor(offset: int) -> str:
+    """Opaque pagination cursor for the item at ``offset``"""
+    return base64.urlsafe_b64encode(json.dumps({"offset": offset}).encode()).decode()
+
+
+def decode_cursor(cursor: Optional[str]) -> int:
+    """Offset a cursor points at; raises ValueError for anything we didn't issue"""
+    if not cursor:
+        return 0
+    try:
+        offset = json.loads(base64.urlsafe_b64decode(cursor.encode()))["offset"]
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not isinstance(offset, int) or offset < 0:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return offset
+
+
+async def paginate(
+    items: AsyncIterator[dict[str, Any]], cursor: Optional[str], limit: Optional[int] = None
+) -> dict[str, Any]:
+    """One page of a listing as ``{"items": [...], "nextCursor": ...}``
+
+    Only the page (plus one look-ahead item) is ever held in memory.
+    ``nextCursor`` is omitted on the last page, as in MCP's list methods.
+    """
+    offset = decode_cursor(cursor)
+    limit = max(1, min(int(limit or PAGE_SIZE), MAX_PAGE_SIZE))
+    page = [item async for item in aslice(items, offset, limit + 1)]
+    result: dict[str, Any] = {"items": page[:limit]}
+    if len(page) > limit:
+        result["nextCursor"] = encode_cursor(offset + limit)
+    return result
+
+
+def build_requirements(repo_path: Path) -> list[str]:
+    """The build-system requirements pip needs to build a project from source"""
+    try:
+        text = (repo_path / "pyproject.toml").read_text()
+    except OSError:
+        return list(DEFAULT_BUILD_REQUIRES)
+    try:
+        import tomllib
+
+        requires = tomllib.loads(text).get("build-system", {}).get("requires")
+    except ImportError:
+        # Python < 3.11: good enough for the one array we need
+        section = re.search(r"^\[build-system\](.*?)(?=^\[|\Z)", text, re.M | re.S)
+        array = section and re.search(r"^requires\s*=\s*\[(.*?)\]", section.group(1), re.M | re.S)
+        requires = re.findall(r"[\"']([^\"']+)[\"']", array.group(1)) if array else None
+    except ValueError:
+        requires = None
+    return list(requires) if isinstance(requires, list) else list(DEFAULT_BUILD_REQUIRES)
+
+
+def project_name(name: str) -> str:
+    """PEP 503 normalized project name, as used to match wheels to requirements"""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def _requirement_name(requirement: str) -> str:
+    match = re.match(r"\s*([A-Za-z0-9][A-Za-z0-9._-]*)", requirement)
+    return project_name(match.group(1)) if match else ""
+
+
+def _wheel_requires(wheel: Path) -> list[str]:
+    """Project names a wheel depends on, extras left out"""
+    try:
+        with zipfile.ZipFile(wheel) as zf:
+            metadata = next(n for n in zf.namelist() if n.endswith(".dist-info/METADATA"))
+            text = zf.read(metadata).decode("utf-8", "replace")
+    except (OSError, StopIteration, zipfile.BadZipFile):
+        return []
+    return [
+        _requirement_name(line.partition(":")[2])
+        for line in text.splitlines()
+        if line.startswith("Requires-Dist:") and "extra ==" not in line
+    ]
+
+
+def image_repository(image: str) -> str:
+    """'ghcr.io/a/img:1.0' -> 'ghcr.io/a/img' (a registry port is not a tag)"""
+    name = image.split("@", 1)[0]
+    colon = name.rfind(":")
+    return name[:colon] if colon > name.rfind("/") else name
+
+
+def _path_size(path: Path) -> int:
+    """Total on-disk size of a file or directory tree"""
+    if not path.is_dir():
+        try:
+            return path.lstat().st_size
+        except OSError:
+            return 0
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.lstat(os.path.join(root, file)).st_size
+            except OSError:
+                pass
+    return total
 
 
 class MCPPackageManager:
-    def __init__(self):
+    def __init__(self, cache_state: bool = False):
         self.session: Optional[aiohttp.ClientSession] = None
-        self.registry: dict[str, Any] = {}
+        self.registry: MutableMapping[str, Any] = {}
         self.installed: dict[str, Any] = {}
+        # Long-running server mode keeps state between requests; a FileWatcher
+        # calls invalidate_installed() / config_manager.invalidate() on edits
+        self.cache_state = cache_state
+        self._installed_fresh = False
+        # Registry sequence marker; loaded is only consulted in server mode
+        self._registry_seq: Any = None
+        self._registry_loaded = False
+        self._config_manager: Optional[MCPConfigManager] = None
         self._ensure_dirs()
 
+    @property
+    def config_manager(self) -> MCPConfigManager:
+        """The MCP config manager sharing this instance's caching policy"""
+        if self._config_manager is None:
+            self._config_manager = MCPConfigManager(cache=self.cache_state)
+        return self._config_manager
+
+    def invalidate_installed(self):
+        """Forget cached installed.json contents"""
+        self._installed_fresh = False
+
     def _ensure_dirs(self):
         """Create the sacred directories"""
         MCPM_HOME.mkdir(exist_ok=True)
@@ -55,21 +265,64 @@ class MCPPackageManager:
         if not INSTALLED_DB.exists():
             INSTALLED_DB.write_text("{}")
 
+    @tracing.traced("mcpm.load_installed")
     async def _load_installed(self):
         """Load the tome of installed servers"""
+        if self.cache_state and self._installed_fresh:
+            return
         try:
             self.installed = json.loads(INSTALLED_DB.read_text())
         except:
             self.installed = {}
+        self._installed_fresh = True
 
+    @tracing.traced("mcpm.save_installed")
     async def _save_installed(self):
         """Persist the installation state"""
         INSTALLED_DB.write_text(json.dumps(self.installed, indent=2))
+        self._installed_fresh = True
 
-    async def _fetch_registry(self):
-        """Load MCP servers registry"""
-        # Use built-in registry of verified MCP servers from @modelcontextprotocol scope
-        self.registry = {
+    def _load_artifacts(self) -> dict[str, list[str]]:
+        """Load the ledger of npm packages and docker images mcpm has pulled
+
+        Before there is a ledger, it is seeded from what installed.json
+        records, so servers installed by older versions can be collected too.
+        """
+        try:
+            ledger = json.loads(ARTIFACTS_DB.read_text())
+        except FileNotFoundError:
+            ledger = {"npm": [], "docker": []}
+            for info in self.installed.values():
+                kind, key = ARTIFACT_KEYS.get(info.get("method", ""), (None, None))
+                artifact = info.get("details", {}).get(key)
+                if kind and artifact and artifact not in ledger[kind]:
+                    ledger[kind].append(artifact)
+        except (OSError, ValueError):
+            ledger = {}
+        return {"npm": ledger.get("npm", []), "docker": ledger.get("docker", [])}
+
+    def _save_artifacts(self, ledger: dict[str, list[str]]):
+        """Persist the artifact ledger"""
+        ARTIFACTS_DB.write_text(json.dumps(ledger, indent=2))
+
+    def _record_artifact(self, result: dict[str, Any]):
+        """Remember a global artifact so gc can find it once nothing references it"""
+        kind, key = ARTIFACT_KEYS.get(result.get("method", ""), (None, None))
+        if kind is None or not result.get(key):
+            return
+        # A ledger seeded from installed.json is written out even when it already has this
+        persisted = ARTIFACTS_DB.exists()
+        ledger = self._load_artifacts()
+        if result[key] not in ledger[kind]:
+            ledger[kind].append(result[key])
+        elif persisted:
+            return
+        self._save_artifacts(ledger)
+
+    @staticmethod
+    def _builtin_registry() -> dict[str, Any]:
+        """Built-in registry of verified MCP servers from @modelcontextprotocol scope"""
+        return {
             "filesystem": {
                 "id": "filesystem",
                 "description": "MCP server for filesystem access",
@@ -122,26 +375,160 @@ class MCPPackageManager:
             }
         }
 
+    @tracing.traced("registry.fetch")
+    async def _fetch_registry(self):
+        """Load MCP servers registry
+
+        The snapshot kept in CACHE_DIR by refresh_registry() wins over the
+        built-in list. In server mode the loaded registry is kept until a
+        refresh replaces it.
+        """
+        if self.cache_state and self._registry_loaded:
+            return
+        store = self._load_registry_snapshot()
+        if store is not None:
+            self._registry_seq = store.seq
+        else:
+            store = RegistryStore.from_entries(self._builtin_registry())
+            self._registry_seq = None
+        self.registry = store
+        self._registry_loaded = True
+
+    def _load_registry_snapshot(self) -> Optional[RegistryStore]:
+        """Map the compact snapshot, migrating a JSON one left by older versions"""
+        store = RegistryStore.open(REGISTRY_STORE)
+        if store is not None:
+            return store
+        try:
+            snapshot = json.loads(REGISTRY_SNAPSHOT.read_text())
+        except (OSError, ValueError):
+            return None
+        if not isinstance(snapshot.get("entries"), dict):
+            return None
+        store = RegistryStore.from_entries(snapshot["entries"], snapshot.get("seq"))
+        try:
+            store = store.write(REGISTRY_STORE)
+            REGISTRY_SNAPSHOT.unlink()
+        except OSError as e:
+            logger.warning(f"Could not migrate registry snapshot: {e}")
+        return store
+
+    def _save_registry_snapshot(self):
+        """Persist registry and sequence marker, replacing the old snapshot atomically"""
+        store = self.registry
+        if not isinstance(store, RegistryStore):
+            store = RegistryStore.from_entries(store)
+        store.seq = self._registry_seq
+        self.registry = store.write(REGISTRY_STORE)
+
+    def _http(self) -> aiohttp.ClientSession:
+        """Shared HTTP session, opened on first use and closed by cleanup()"""
+        if self.session is None:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        return self.session
+
+    async def _fetch_registry_changes(self, feed: str, since: Any) -> bytes:
+        """Fetch the changes feed: over http(s) with ?since=, or a local stand-in file"""
+        if feed.startswith(("http://", "https://")):
+            params = {"since": str(since)} if since is not None else {}
+            async with self._http().get(feed, params=params) as resp:
+                resp.raise_for_status()
+                return await resp.read()
+        path = Path(feed.removeprefix("file://"))
+        return await asyncio.to_thread(path.read_bytes)
+
+    @tracing.traced("registry.refresh")
+    async def refresh_registry(self) -> dict[str, Any]:
+        """Bring the registry snapshot up to date with only what changed
+
+        The feed (``MCPM_REGISTRY_FEED``) answers ``since=<seq>`` with
+        ``{"seq": N, "reset": bool, "changes": [{"seq", "id", "entry" | "deleted"}]}``.
+        Changes are applied as upserts and deletes over the mapped snapshot,
+        which is then rewritten once; ``reset`` (or no previous marker)
+        starts from empty.
+        """
+        feed = os.environ.get(REGISTRY_FEED_ENV)
+        if not feed:
+            return {"error": f"No registry feed configured (set {REGISTRY_FEED_ENV})"}
+
+        snapshot = self._load_registry_snapshot()
+        since = snapshot.seq if snapshot else None
+        try:
+            payload = await self._fetch_registry_changes(feed, since)
+            delta = json.loads(payload)
+        except Exception as e:
+            return {"error": f"Failed to fetch registry changes: {e}"}
+
+        if snapshot is None or delta.get("reset"):
+            self.registry = RegistryStore.from_entries({})
+        else:
+            self.registry = snapshot
+        self._registry_loaded = True
+
+        upserted = deleted = 0
+        for change in delta.get("changes", []):
+            # A static feed can't filter by marker, so skip what we've already applied
+            stale = since is not None and "seq" in change and change["seq"] <= since
+            if stale and not delta.get("reset"):
+                continue
+            name = change["id"]
+            if change.get("deleted"):
+                if self.registry.pop(name, None) is not None:
+                    deleted += 1
+            else:
+                entry = {"id": name, **change.get("entry", {})}
+                self.registry[name] = entry
+                upserted += 1
+
+        self._registry_seq = delta.get("seq", since)
+        if upserted or deleted or self._registry_seq != since:
+            self._save_registry_snapshot()
+        return {
+            "seq": self._registry_seq,
+            "upserted": upserted,
+            "deleted": deleted,
+            "entries": len(self.registry),
+            "transferred_bytes": len(payload),
+        }
+
     async def list_available(self) -> list[dict[str, Any]]:
         """List all servers in the multiverse"""
+        return [server async for server in self.iter_available()]
+
+    async def iter_available(self) -> AsyncIterator[dict[str, Any]]:
+        """Yield registry servers one at a time"""
         await self._fetch_registry()
-        return [
-            {"name": k, "description": v.get("description", ""), "installed": k in self.installed}
-            for k, v in self.registry.items()
-        ]
+        registry = self.registry
+        # The store tolerates refresh editing it between yields; a plain dict needs a copy
+        if isinstance(registry, RegistryStore):
+            summaries = registry.summaries()
+        else:
+            summaries = [(n, s.get("description", "")) for n, s in registry.items()]
+        for name, description in summaries:
+            yield {"name": name, "description": description, "installed": name in self.installed}
 
     async def search(self, query: str) -> list[dict[str, Any]]:
         """Search the cosmic registry"""
         await self._fetch_registry()
+        registry = self.registry
+        if isinstance(registry, RegistryStore):
+            return [{"name": n, "description": d} for n, d in registry.search(query)]
         query = query.lower()
-        results = []
-        for name, server in self.registry.items():
-            if query in name.lower() or query in server.get("description", "").lower():
-                results.append({"name": name, "description": server.get("description", "")})
-        return results
+        return [
+            {"name": name, "description": server.get("description", "")}
+            for name, server in registry.items()
+            if query in haystack(name, server)
+        ]
 
     async def install(self, name: str) -> dict[str, Any]:
-        """Install a server from the void"""
+        """Install a server from the void
+
+        npm servers are resolved through the cached packument, to the best
+        match for ``name@range`` or to ``latest``, and installed at exactly
+        that version; the version and integrity hash are recorded. A plain
+        install whose metadata can't be fetched falls back to an unpinned one.
+        """
+        name, spec = split_spec(name)
         await self._fetch_registry()
         await self._load_installed()
 
@@ -152,89 +539,847 @@ class MCPPackageManager:
             return {"error": f"Server '{name}' already installed"}
 
         server = self.registry[name]
-
-        # Determine installation method
+        if spec and "npm" not in server:
+            return {"error": f"Version ranges are only supported for npm servers, not '{name}'"}
+        pinned: Optional[dict[str, Any]] = None
         if "npm" in server:
-            result = await self._install_npm(name, server["npm"])
-        elif "docker" in server:
-            result = await self._install_docker(name, server["docker"])
-        elif "git" in server:
-            result = await self._install_git(name, server["git"])
-        else:
-            return {"error": f"No installation method found for '{name}'"}
+            pinned = await self._resolve_npm(server["npm"], spec or "latest")
+            if "error" in pinned:
+                if spec:
+                    return pinned
+                logger.warning(f"Installing {name} unpinned: {pinned['error']}")
+                pinned = None
+            else:
+                server = {**server, "version": pinned["version"]}
+
+        result = await self._install_source(name, server)
+        if pinned and "error" not in result:
+            if pinned["integrity"]:
+                result["integrity"] = pinned["integrity"]
+            if spec:
+                result["spec"] = spec
 
         if "error" not in result:
             self.installed[name] = {"method": result["method"], "details": result}
             await self._save_installed()
+            self._record_artifact(result)
 
         return result
 
-    async def _install_npm(self, name: str, package: str) -> dict[str, Any]:
-        """Channel the npm spirits"""
+    async def _resolve_npm(self, package: str, spec: str) -> dict[str, Any]:
+        """Resolve a range to an exact version using the cached abbreviated packument"""
         try:
-            proc = await asyncio.create_subprocess_exec(
-                "npm", "install", "-g", package, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            packument = await PackumentCache(PACKUMENT_CACHE).fetch(self._http(), package)
+        except Exception as e:
+            return {"error": f"Failed to fetch metadata for {package}: {e}"}
+        manifest = resolve(packument, spec)
+        if manifest is None:
+            return {"error": f"No version of {package} matches '{spec}'"}
+        return {
+            "version": manifest["version"],
+            "integrity": manifest.get("dist", {}).get("integrity"),
+        }
+
+    async def _npm_global_versions(self) -> dict[str, str]:
+        """Versions of all global npm packages from a single npm ls"""
+        try:
+            _, stdout, _ = await self._run("npm", "ls", "-g", "--json", "--depth=0")
+            dependencies = json.loads(stdout.decode() or "{}").get("dependencies", {})
+        except Exception as e:
+            logger.warning(f"npm ls failed: {e}")
+            return {}
+        return {pkg: info.get("version") for pkg, info in dependencies.items() if info}
+
+    async def outdated(self) -> list[dict[str, Any]]:
+        """Compare installed npm servers against the registry in one concurrent round"""
+        await self._load_installed()
+        npm = {
+            name: info["details"]
+            for name, info in self.installed.items()
+            if info.get("method") == "npm" and info.get("details", {}).get("package")
+        }
+        if not npm:
+            return []
+
+        current = {name: details.get("version") for name, details in npm.items()}
+        if None in current.values():
+            # Unpinned installs didn't record a version; ask npm once for all of them
+            global_versions = await self._npm_global_versions()
+            for name, details in npm.items():
+                current[name] = current[name] or global_versions.get(details["package"])
+
+        cache = PackumentCache(PACKUMENT_CACHE)
+        packages = sorted({details["package"] for details in npm.values()})
+        fetched = await asyncio.gather(
+            *(cache.fetch(self._http(), package) for package in packages), return_exceptions=True
+        )
+        packuments = dict(zip(packages, fetched))
+
+        rows = []
+        for name, details in npm.items():
+            row = {
+                "name": name,
+                "package": details["package"],
+                "current": current[name],
+                "spec": details.get("spec"),
+            }
+            packument = packuments[details["package"]]
+            if isinstance(packument, Exception):
+                row["error"] = str(packument)
+                rows.append(row)
+                continue
+            wanted = resolve(packument, details.get("spec") or "latest")
+            row["wanted"] = wanted["version"] if wanted else None
+            row["latest"] = packument.get("dist-tags", {}).get("latest")
+            installed_key = parse_version(current[name] or "")
+            row["outdated"] = any(
+                installed_key is not None
+                and parse_version(v or "") is not None
+                and parse_version(v) > installed_key
+                for v in (row["wanted"], row["latest"])
+            )
+            rows.append(row)
+        return rows
+
+    async def status(self, repair: bool = False) -> dict[str, Any]:
+        """Check every installed server against what is really on the machine
+
+        One ``npm ls -g``, one ``docker image inspect`` and one ``git
+        rev-parse`` per checkout all run at once, so the check takes about as
+        long as the slowest of them no matter how many servers are installed.
+        With ``repair`` the drifted servers are reinstalled concurrently. The
+        report ends with the subprocess scheduler's queue metrics.
+        """
+        await self._load_installed()
+        by_method: dict[str, dict[str, dict[str, Any]]] = {"npm": {}, "docker": {}, "git": {}}
+        for name, info in self.installed.items():
+            by_method.get(info.get("method"), {})[name] = info.get("details", {})
+
+        async def nothing() -> dict:
+            return {}
+
+        images = sorted({d["image"] for d in by_method["docker"].values() if d.get("image")})
+        git_names = list(by_method["git"])
+        npm_versions, docker_present, *heads = await asyncio.gather(
+            self._npm_global_versions() if by_method["npm"] else nothing(),
+            self._inspect_docker_images(images) if images else nothing(),
+            *(self._git_head(Path(by_method["git"][n].get("path", ""))) for n in git_names),
+        )
+        git_heads = dict(zip(git_names, heads))
+
+        servers = []
+        for name, info in self.installed.items():
+            details = info.get("details", {})
+            method = info.get("method")
+            problems = []
+            if method == "npm":
+                found = npm_versions.get(details.get("package"))
+                if found is None:
+                    problems.append("npm package missing")
+                elif details.get("version") and found != details["version"]:
+                    problems.append(f"npm version {found} != recorded {details['version']}")
+            elif method == "docker":
+                if details.get("image") not in docker_present:
+                    problems.append("docker image missing")
+            elif method == "git":
+                head = git_heads.get(name)
+                if head is None:
+                    problems.append("git checkout missing")
+                elif details.get("commit") and head != details["commit"]:
+                    problems.append(f"git HEAD {head[:12]} != recorded {details['commit'][:12]}")
+                if details.get("python") and not Path(details["python"]).exists():
+                    problems.append("virtualenv missing")
+            servers.append({"name": name, "method": method, "ok": not problems, "problems": problems})
+
+        report: dict[str, Any] = {
+            "servers": servers,
+            "drifted": [s["name"] for s in servers if not s["ok"]],
+        }
+        if repair and report["drifted"]:
+            report["repaired"], report["errors"] = await self._repair(report["drifted"])
+        report["scheduler"] = scheduler.get_scheduler().metrics()
+        return report
+
+    @scheduler.at_priority(scheduler.BULK)
+    async def _repair(self, names: list[str]) -> tuple[list[str], dict[str, str]]:
+        """Reinstall drifted servers from their recorded source, all at once"""
+        infos = {name: self.installed[name] for name in names}
+        outcomes = await asyncio.gather(
+            *(self._repair_one(name, info) for name, info in infos.items())
+        )
+        repaired, errors = [], {}
+        for (name, info), outcome in zip(infos.items(), outcomes):
+            if "error" in outcome or "venv_error" in outcome:
+                errors[name] = outcome.get("error") or f"virtualenv: {outcome['venv_error']}"
+                continue
+            # Keep what the original install recorded (range, integrity) alongside the fresh result
+            self.installed[name] = {"method": outcome["method"], "details": {**info["details"], **outcome}}
+            repaired.append(name)
+        if repaired:
+            await self._save_installed()
+        return repaired, errors
+
+    async def _repair_one(self, name: str, info: dict[str, Any]) -> dict[str, Any]:
+        """Fix one server in place where possible, re-cloning a checkout only as a last resort
+
+        A checkout that is still there is moved back to its recorded commit
+        and gets its venv rebuilt. Anything else is reinstalled, with the
+        old checkout set aside and put back if that fails.
+        """
+        details = info["details"]
+        if info.get("method") == "git" and details.get("path"):
+            path = Path(details["path"])
+            head = await self._git_head(path)
+            if head is not None:
+                code = 0
+                if details.get("commit") and head != details["commit"]:
+                    code, _, _ = await self._run(
+                        "git", "-C", str(path), "checkout", "--quiet", "--detach", details["commit"]
+                    )
+                if code == 0:
+                    return await self._describe_checkout(name, details.get("repo", ""), path)
+        moved = self._set_aside(info)
+        outcome = await self._install_source(name, self._source_of(details))
+        self._put_back(moved, restore="error" in outcome or "venv_error" in outcome)
+        return outcome
+
+    async def _install_source(self, name: str, server: dict[str, Any]) -> dict[str, Any]:
+        """Install from a registry or lockfile entry using its declared backend"""
+        if "npm" in server:
+            return await self._install_npm(
+                name, server["npm"], server.get("version"), server.get("integrity")
             )
-            stdout, stderr = await proc.communicate()
-            if proc.returncode == 0:
-                return {"method": "npm", "package": package, "status": "installed"}
+        elif "docker" in server:
+            return await self._install_docker(name, server["docker"], server.get("digest"))
+        elif "git" in server:
+            return await self._install_git(name, server["git"], server.get("commit"))
+        return {"error": f"No installation method found for '{name}'"}
+
+    @tracing.traced("install.npm")
+    async def _install_npm(
+        self,
+        name: str,
+        package: str,
+        version: Optional[str] = None,
+        integrity: Optional[str] = None,
+    ) -> dict[str, Any]:
+        """Channel the npm spirits
+
+        With a locked ``integrity`` the registry's hash for the version must
+        match before installing; npm then checks the tarball against it.
+        """
+        if integrity:
+            published = await self._resolve_npm(package, version or "latest")
+            if "error" in published:
+                return published
+            if published["integrity"] != integrity:
+                return {
+                    "error": f"Integrity mismatch for {package}@{published['version']}: "
+                    f"registry has {published['integrity']}, lockfile pins {integrity}"
+                }
+        spec = f"{package}@{version}" if version else package
+        try:
+            code, _, stderr = await self._run("npm", "install", "-g", spec)
+            if code == 0:
+                result = {"method": "npm", "package": package, "status": "installed"}
+                if version:
+                    result["version"] = version
+                if integrity:
+                    result["integrity"] = integrity
+                return result
             return {"error": stderr.decode()}
         except Exception as e:
             return {"error": str(e)}
 
-    async def _install_docker(self, name: str, image: str) -> dict[str, Any]:
-        """Summon the container daemon"""
+    @tracing.traced("install.docker")
+    async def _install_docker(
+        self, name: str, image: str, digest: Optional[str] = None
+    ) -> dict[str, Any]:
+        """Summon the container daemon
+
+        A locked ``digest`` is pulled as ``repo@digest`` and tagged as the
+        image, so the generated config runs exactly that content.
+        """
+        ref = f"{image_repository(image)}@{digest}" if digest else image
         try:
-            proc = await asyncio.create_subprocess_exec(
-                "docker", "pull", image, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-            )
-            stdout, stderr = await proc.communicate()
-            if proc.returncode == 0:
-                return {"method": "docker", "image": image, "status": "pulled"}
-            return {"error": stderr.decode()}
+            code, _, stderr = await self._run("docker", "pull", ref)
+            if code == 0 and digest and "@" not in image:
+                code, _, stderr = await self._run("docker", "tag", ref, image)
+            if code != 0:
+                return {"error": stderr.decode()}
         except Exception as e:
             return {"error": str(e)}
+        result = {"method": "docker", "image": image, "status": "pulled"}
+        digest = digest or (await self._docker_digests([image])).get(image)
+        if digest:
+            result["digest"] = digest
+        return result
+
+    async def _docker_digests(self, images: list[str]) -> dict[str, str]:
+        """Registry digest (sha256:...) of each locally present image, in one docker call"""
+        try:
+            _, stdout, _ = await self._run("docker", "image", "inspect", *images)
+            found = json.loads(stdout.decode() or "[]")
+        except Exception:
+            return {}
+        digests: dict[str, str] = {}
+        for image in images:
+            repo = image_repository(image)
+            for info in found:
+                refs = set(info.get("RepoTags") or []) | set(info.get("RepoDigests") or [])
+                if not ({image, f"{image}:latest"} & refs or info.get("Id") == image):
+                    continue
+                for ref in info.get("RepoDigests") or []:
+                    if ref.split("@", 1)[0] == repo:
+                        digests[image] = ref.split("@", 1)[1]
+                        break
+        return digests
 
-    async def _install_git(self, name: str, repo: str) -> dict[str, Any]:
-        """Clone from the source"""
+    @tracing.traced("install.git")
+    async def _install_git(self, name: str, repo: str, commit: Optional[str] = None) -> dict[str, Any]:
+        """Clone from the source, at ``commit`` when one is locked"""
         target = MCPM_HOME / "repos" / name
         target.parent.mkdir(exist_ok=True)
         try:
-            proc = await asyncio.create_subprocess_exec(
-                "git", "clone", repo, str(target), stdout=subprocess.PIPE, stderr=subprocess.PIPE
-            )
-            stdout, stderr = await proc.communicate()
-            if proc.returncode == 0:
-                return {"method": "git", "repo": repo, "path": str(target), "status": "cloned"}
-            return {"error": stderr.decode()}
+            code, _, stderr = await self._run("git", "clone", repo, str(target))
+            if code == 0 and commit:
+                code, _, stderr = await self._run(
+                    "git", "-C", str(target), "checkout", "--quiet", "--detach", commit
+                )
+            if code != 0:
+                shutil.rmtree(target, ignore_errors=True)
+                return {"error": stderr.decode()}
         except Exception as e:
             return {"error": str(e)}
 
-    async def uninstall(self, name: str) -> dict[str, Any]:
-        """Banish a server back to the void"""
+        return await self._describe_checkout(name, repo, target)
+
+    async def _describe_checkout(self, name: str, repo: str, target: Path) -> dict[str, Any]:
+        """Record a fresh checkout's commit and give Python servers their venv"""
+        result = {"method": "git", "repo": repo, "path": str(target), "status": "cloned"}
+        head = await self._git_head(target)
+        if head:
+            result["commit"] = head
+        if any((target / marker).exists() for marker in PYTHON_PROJECT_MARKERS):
+            result.update(await self._build_venv(name, target))
+        return result
+
+    async def _git_head(self, path: Path) -> Optional[str]:
+        """Commit checked out at path, or None if it isn't a git checkout"""
+        try:
+            code, stdout, _ = await self._run("git", "-C", str(path), "rev-parse", "HEAD")
+        except Exception:
+            return None
+        return stdout.decode().strip() if code == 0 else None
+
+    @tracing.traced("install.venv")
+    async def _build_venv(self, name: str, repo_path: Path) -> dict[str, Any]:
+        """Give a Python server its own virtualenv with dependencies and bytecode ready
+
+        Dependencies are installed from the shared wheel cache first, so a warm
+        cache needs no network; on a miss the wheels are built into the cache
+        and the offline install is retried. A project installed from its own
+        source also gets its build-system requirements cached, since pip's
+        isolated build needs them and takes them from the same --find-links.
+        The repo is then precompiled so the first launch doesn't pay for it.
+        """
+        venv = VENVS_DIR / name
+        python = venv / ("Scripts/python.exe" if sys.platform == "win32" else "bin/python")
+        VENVS_DIR.mkdir(exist_ok=True)
+        WHEEL_CACHE.mkdir(parents=True, exist_ok=True)
+
+        build_requires: list[str] = []
+        if (repo_path / "requirements.txt").exists():
+            requirements = ["-r", str(repo_path / "requirements.txt")]
+        elif (repo_path / "pyproject.toml").exists() or (repo_path / "setup.py").exists():
+            requirements = [str(repo_path)]
+            build_requires = build_requirements(repo_path)
+        else:
+            requirements = []
+
+        try:
+            code, _, stderr = await self._run(sys.executable, "-m", "venv", str(venv))
+            if code != 0:
+                raise RuntimeError(stderr.decode())
+            if requirements:
+                pip = [str(python), "-m", "pip", "--disable-pip-version-check", "-q"]
+                offline = [*pip, "install", "--compile", "--no-index", "--find-links", str(WHEEL_CACHE)]
+                code, _, _ = await self._run(*offline, *requirements)
+                if code != 0:
+                    code, _, stderr = await self._run(
+                        *pip, "wheel", "--wheel-dir", str(WHEEL_CACHE),
+                        "--find-links", str(WHEEL_CACHE), *build_requires, *requirements,
+                    )
+                    if code == 0:
+                        code, _, stderr = await self._run(*offline, *requirements)
+                    if code != 0:
+                        raise RuntimeError(stderr.decode())
+            await self._run(str(python), "-m", "compileall", "-q", "-j", "0", str(repo_path))
+        except Exception as e:
+            logger.warning(f"Could not build virtualenv for {name}: {e}")
+            return {"venv_error": str(e)}
+
+        return {"venv": str(venv), "python": str(python)}
+
+    def _venv_wheels(self, details: dict[str, Any]) -> list[Path]:
+        """Cached wheels a git server's venv needs to be rebuilt offline
+
+        That's what is installed in the venv plus, for a project built from its
+        own source, the build backend, each with its cached dependencies.
+        """
+        if not details.get("venv") or not WHEEL_CACHE.is_dir():
+            return []
+        cached: dict[str, list[Path]] = {}
+        for wheel in WHEEL_CACHE.glob("*.whl"):
+            cached.setdefault(project_name(wheel.name.split("-")[0]), []).append(wheel)
+
+        venv, repo = Path(details["venv"]), Path(details.get("path", ""))
+        pending = []
+        site_packages = ("lib/python*/site-packages", "Lib/site-packages")
+        for info in (i for pattern in site_packages for i in venv.glob(f"{pattern}/*.dist-info")):
+            dist, _, version = info.name.removesuffix(".dist-info").partition("-")
+            wheels = cached.get(project_name(dist), [])
+            pending += [w for w in wheels if w.name.split("-")[1] == version]
+        if not (repo / "requirements.txt").exists() and any(
+            (repo / marker).exists() for marker in ("pyproject.toml", "setup.py")
+        ):
+            for requirement in build_requirements(repo):
+                pending += cached.get(_requirement_name(requirement), [])
+
+        selected: set[Path] = set()
+        while pending:
+            wheel = pending.pop()
+            if wheel not in selected:
+                selected.add(wheel)
+                pending += [w for r in _wheel_requires(wheel) for w in cached.get(r, [])]
+        return sorted(selected)
+
+    async def uninstall(self, name: str, gc: Optional[bool] = None) -> dict[str, Any]:
+        """Banish a server back to the void
+
+        With ``gc`` (or ``MCPM_AUTO_GC=1``) the artifacts it leaves behind are
+        collected straight away.
+        """
         await self._load_installed()
 
         if name not in self.installed:
             return {"error": f"Server '{name}' not installed"}
 
         info = self.installed[name]
+        # Ledgered before the entry goes, so gc can collect it even if it was
+        # installed before the ledger existed
+        self._record_artifact({"method": info.get("method"), **info.get("details", {})})
+        self._remove_checkout(info)
+        del self.installed[name]
+        await self._save_installed()
+        result: dict[str, Any] = {"status": "uninstalled", "name": name}
 
-        # Clean up based on installation method
+        if gc is None:
+            gc = os.environ.get(AUTO_GC_ENV, "") not in ("", "0", "false")
+        if gc:
+            result["gc"] = await self.gc()
+        return result
+
+    def _remove_checkout(self, info: dict[str, Any]):
+        """Clean up the on-disk parts of an install that belong to mcpm alone"""
         if info["method"] == "git" and "path" in info["details"]:
             path = Path(info["details"]["path"])
             if path.exists():
-                import shutil
-
                 shutil.rmtree(path)
+        for key in ("venv", "package_dir"):
+            if info["details"].get(key):
+                shutil.rmtree(info["details"][key], ignore_errors=True)
 
-        del self.installed[name]
-        await self._save_installed()
-        return {"status": "uninstalled", "name": name}
+    @staticmethod
+    def _set_aside(info: dict[str, Any]) -> list[tuple[Path, Path]]:
+        """Move a git checkout and venv out of a reinstall's way, keeping them for rollback"""
+        details = info.get("details", {})
+        paths = [Path(details["venv"])] if details.get("venv") else []
+        if info.get("method") == "git" and details.get("path"):
+            paths.append(Path(details["path"]))
+        moved = []
+        for path in paths:
+            if path.exists():
+                aside = path.with_name(f".{path.name}.aside")
+                shutil.rmtree(aside, ignore_errors=True)
+                path.rename(aside)
+                moved.append((path, aside))
+        return moved
+
+    @staticmethod
+    def _put_back(moved: list[tuple[Path, Path]], restore: bool):
+        """Restore what _set_aside moved (the reinstall failed) or drop it (it worked)"""
+        for path, aside in moved:
+            if restore:
+                shutil.rmtree(path, ignore_errors=True)
+                aside.rename(path)
+            else:
+                shutil.rmtree(aside, ignore_errors=True)
+
+    @tracing.traced("mcpm.gc")
+    @scheduler.at_priority(scheduler.BACKGROUND)
+    async def gc(self, cache_budget: Optional[int] = None) -> dict[str, Any]:
+        """Reclaim disk from artifacts no installed server references
+
+        Orphaned npm packages and docker images are removed in one batched
+        ``npm uninstall -g`` / ``docker rmi`` call each, stray checkouts,
+        virtualenvs and bundle-restored npm packages under ``MCPM_HOME`` are pruned and ``CACHE_DIR`` is trimmed to
+        ``cache_budget`` bytes (default ``MCPM_CACHE_BUDGET``) by evicting the
+        least recently used files first. The registry snapshot lives in the
+        cache too but is never evicted: it can't be rebuilt without the feed.
+        """
+        if cache_budget is None and os.environ.get(CACHE_BUDGET_ENV):
+            try:
+                cache_budget = parse_size(os.environ[CACHE_BUDGET_ENV])
+            except ValueError as e:
+                return {"error": f"{CACHE_BUDGET_ENV}: {e}"}
+
+        await self._load_installed()
+        ledger = self._load_artifacts()
+        details = [info.get("details", {}) for info in self.installed.values()]
+        referenced_npm = {d.get("package") for d in details if d.get("method") == "npm"}
+        referenced_docker = {d.get("image") for d in details if d.get("method") == "docker"}
+
+        report: dict[str, Any] = {
+            "npm": [],
+            "docker": [],
+            "repos": [],
+            "venvs": [],
+            "npm_packages": [],
+            "cache": [],
+        }
+        reclaimed = 0
+
+        orphan_npm = [p for p in ledger["npm"] if p not in referenced_npm]
+        if orphan_npm:
+            freed, removed = await self._gc_npm(orphan_npm)
+            reclaimed += freed
+            report["npm"] = removed
+            ledger["npm"] = [p for p in ledger["npm"] if p not in removed]
+
+        orphan_docker = [i for i in ledger["docker"] if i not in referenced_docker]
+        if orphan_docker:
+            freed, removed = await self._gc_docker(orphan_docker)
+            reclaimed += freed
+            report["docker"] = removed
+            ledger["docker"] = [i for i in ledger["docker"] if i not in removed]
+
+        if orphan_npm or orphan_docker:
+            self._save_artifacts(ledger)
+
+        freed, report["repos"] = self._gc_dirs(MCPM_HOME / "repos", details, "path")
+        reclaimed += freed
+        freed, report["venvs"] = self._gc_dirs(VENVS_DIR, details, "venv")
+        reclaimed += freed
+        # Package trees unpacked from bundles, which npm links to globally
+        freed, report["npm_packages"] = self._gc_dirs(
+            MCPM_HOME / "npm-packages", details, "package_dir"
+        )
+        reclaimed += freed
+
+        if cache_budget is not None:
+            freed, report["cache"] = self._gc_cache(cache_budget)
+            reclaimed += freed
+
+        report["reclaimed_bytes"] = reclaimed
+        return report
+
+    async def _run(self, *cmd: str) -> tuple[int, bytes, bytes]:
+        """Run a command through the shared scheduler, returning (returncode, stdout, stderr)
+
+        Priority comes from the surrounding ``scheduler.priority()`` block; the
+        trace span records how long the command queued for a slot.
+        """
+        with tracing.span("subprocess", argv=cmd[:3]) as span:
+            return await scheduler.get_scheduler().run(*cmd, stats=span.args if span else None)
+
+    async def _gc_npm(self, packages: list[str]) -> tuple[int, list[str]]:
+        """Uninstall orphaned global npm packages in a single call"""
+        freed = 0
+        try:
+            code, stdout, _ = await self._run("npm", "root", "-g")
+            if code == 0:
+                root = Path(stdout.decode().strip())
+                freed = sum(_path_size(root / package) for package in packages)
+            code, _, stderr = await self._run("npm", "uninstall", "-g", *packages)
+        except Exception as e:
+            logger.warning(f"npm gc failed: {e}")
+            return 0, []
+        if code != 0:
+            logger.warning(f"npm gc failed: {stderr.decode().strip()}")
+            return 0, []
+        return freed, packages
+
+    async def _gc_docker(self, images: list[str]) -> tuple[int, list[str]]:
+        """Remove orphaned docker images in a single call"""
+        try:
+            sizes = await self._inspect_docker_images(images)
+            _, _, stderr = await self._run("docker", "rmi", *images)
+            # rmi keeps going past images that are in use, so check what is actually gone
+            still_present = await self._inspect_docker_images(images)
+        except Exception as e:
+            logger.warning(f"docker gc failed: {e}")
+            return 0, []
+        removed = [i for i in images if i not in still_present]
+        if len(removed) < len(images):
+            logger.warning(f"docker gc kept some images: {stderr.decode().strip()}")
+        return sum(sizes.get(i, 0) for i in removed), removed
+
+    async def _inspect_docker_images(self, images: list[str]) -> dict[str, int]:
+        """Map each locally present image to its size with one docker call"""
+        # inspect exits non-zero if any image is missing but still reports the rest
+        _, stdout, _ = await self._run("docker", "image", "inspect", *images)
+        try:
+            found = json.loads(stdout.decode() or "[]")
+        except ValueError:
+            return {}
+        present: dict[str, int] = {}
+        for info in found:
+            refs = set(info.get("RepoTags") or []) | set(info.get("RepoDigests") or [])
+            for image in images:
+                if image in refs or f"{image}:latest" in refs or info.get("Id") == image:
+                    present[image] = info.get("Size", 0)
+        return present
+
+    def _gc_dirs(
+        self, parent: Path, details: list[dict[str, Any]], key: str
+    ) -> tuple[int, list[str]]:
+        """Prune checkouts or virtualenvs under parent that no installed server owns"""
+        if not parent.is_dir():
+            return 0, []
+        owned = {Path(d[key]).resolve() for d in details if d.get(key)}
+        freed, removed = 0, []
+        for entry in parent.iterdir():
+            if entry.resolve() in owned:
+                continue
+            freed += _path_size(entry)
+            if entry.is_dir() and not entry.is_symlink():
+                shutil.rmtree(entry, ignore_errors=True)
+            else:
+                entry.unlink(missing_ok=True)
+            removed.append(entry.name)
+        return freed, removed
+
+    def _gc_cache(self, budget: int) -> tuple[int, list[str]]:
+        """Evict least recently used files until CACHE_DIR fits in budget"""
+        keep = {REGISTRY_STORE, REGISTRY_SNAPSHOT, REGISTRY_STORE.with_suffix(".tmp")}
+        entries = []
+        for root, _dirs, files in os.walk(CACHE_DIR):
+            for file in files:
+                path = Path(root) / file
+                if path in keep:
+                    continue
+                try:
+                    st = path.lstat()
+                except OSError:
+                    continue
+                # atime is unreliable on relatime/noatime mounts, so take the later stamp
+                entries.append((max(st.st_atime, st.st_mtime), st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        freed, evicted = 0, []
+        for _, size, path in sorted(entries, key=lambda e: e[0]):
+            if total - freed <= budget:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            freed += size
+            evicted.append(str(path.relative_to(CACHE_DIR)))
+        return freed, evicted
 
     async def list_installed(self) -> list[dict[str, Any]]:
         """Show the chosen ones"""
+        return [server async for server in self.iter_installed()]
+
+    async def iter_installed(self) -> AsyncIterator[dict[str, Any]]:
+        """Yield installed servers one at a time"""
+        await self._load_installed()
+        installed = self.installed
+        for name in list(installed):
+            info = installed.get(name)
+            if info is not None:
+                yield {"name": name, **info}
+
+    @staticmethod
+    def _source_of(details: dict[str, Any]) -> dict[str, Any]:
+        """Describe where an install came from, in lockfile terms"""
+        source: dict[str, Any] = {}
+        for backend, key in (("npm", "package"), ("docker", "image"), ("git", "repo")):
+            if details.get(key):
+                source[backend] = details[key]
+                break
+        for pin in LOCK_PINS:
+            if details.get(pin):
+                source[pin] = details[pin]
+        return source
+
+    async def _record_pins(self):
+        """Fill in exact npm versions, docker digests and git commits installs didn't record
+
+        One npm ls, one docker image inspect and parallel git rev-parse calls;
+        what they find is saved to installed.json so lock and sync agree.
+        """
+        missing = {
+            pin: {
+                name: info["details"]
+                for name, info in self.installed.items()
+                if info.get("method") == method and not info.get("details", {}).get(pin)
+            }
+            for method, pin in (("npm", "version"), ("docker", "digest"), ("git", "commit"))
+        }
+
+        async def nothing() -> dict:
+            return {}
+
+        images = sorted({d["image"] for d in missing["digest"].values() if d.get("image")})
+        git_names = list(missing["commit"])
+        versions, digests, *heads = await asyncio.gather(
+            self._npm_global_versions() if missing["version"] else nothing(),
+            self._docker_digests(images) if images else nothing(),
+            *(self._git_head(Path(missing["commit"][n].get("path", ""))) for n in git_names),
+        )
+        found = {
+            "version": {n: versions.get(d.get("package")) for n, d in missing["version"].items()},
+            "digest": {n: digests.get(d.get("image")) for n, d in missing["digest"].items()},
+            "commit": dict(zip(git_names, heads)),
+        }
+        changed = False
+        for pin, values in found.items():
+            for name, value in values.items():
+                if value:
+                    missing[pin][name][pin] = value
+                    changed = True
+        if changed:
+            await self._save_installed()
+
+    async def lock(self, path: Optional[str] = None) -> dict[str, Any]:
+        """Write a lockfile describing the installed servers and their config"""
         await self._load_installed()
-        return [{"name": k, **v} for k, v in self.installed.items()]
+        await self._record_pins()
+        config_mgr = self.config_manager
+        configured = (await config_mgr.load_config()).get("mcpServers", {})
+
+        servers: dict[str, Any] = {}
+        for name, info in sorted(self.installed.items()):
+            entry = self._source_of(info.get("details", {}))
+            if name in configured:
+                generated = config_mgr.generate_server_config(info["details"])
+                overrides = {
+                    k: v for k, v in configured[name].items() if generated.get(k) != v
+                }
+                if overrides:
+                    entry["config"] = overrides
+            else:
+                entry["configure"] = False
+            servers[name] = entry
+
+        lock_path = Path(path or LOCKFILE_NAME)
+        lock_path.write_text(
+            json.dumps({"lockfileVersion": LOCKFILE_VERSION, "servers": servers}, indent=2) + "\n"
+        )
+        return {"status": "locked", "path": str(lock_path), "servers": len(servers)}
+
+    @tracing.traced("mcpm.sync")
+    @scheduler.at_priority(scheduler.BULK)
+    async def sync(self, path: Optional[str] = None) -> dict[str, Any]:
+        """Converge installed.json and the MCP config onto a lockfile
+
+        Only the difference is acted on: installs and removals run
+        concurrently, installed.json is written once and the client config is
+        written at most once. An up-to-date machine costs two file reads.
+        """
+        lock_path = Path(path or LOCKFILE_NAME)
+        try:
+            locked = json.loads(lock_path.read_text()).get("servers", {})
+        except (OSError, ValueError) as e:
+            return {"error": f"Failed to read lockfile {lock_path}: {e}"}
+
+        await self._load_installed()
+        config_mgr = self.config_manager
+        configured = (await config_mgr.load_config()).get("mcpServers", {})
+
+        # Entries that only name a server take their source from the registry
+        if any(not {"npm", "docker", "git"} & entry.keys() for entry in locked.values()):
+            await self._fetch_registry()
+        sources = {}
+        for name, entry in locked.items():
+            spec = entry if {"npm", "docker", "git"} & entry.keys() else self.registry.get(name, {})
+            sources[name] = {
+                k: v for k, v in {**spec, **entry}.items() if k in ("npm", "docker", "git", *LOCK_PINS)
+            }
+
+        def drifted(name: str, info: dict[str, Any]) -> bool:
+            # Only what the lockfile pins has to match; extra recorded facts don't
+            current = self._source_of(info.get("details", {}))
+            return any(current.get(k) != v for k, v in sources[name].items())
+
+        to_remove = [name for name in self.installed if name not in locked]
+        to_install = [
+            name for name in locked if name not in self.installed or drifted(name, self.installed[name])
+        ]
+
+        result: dict[str, Any] = {
+            "installed": [],
+            "removed": [],
+            "config_updated": [],
+            "config_removed": [],
+            "errors": {},
+        }
+
+        for name in to_remove:
+            self._remove_checkout(self.installed.pop(name))
+        result["removed"] = to_remove
+
+        # A reinstalled checkout is moved aside so it can be cloned again, and
+        # put back (with its installed entry untouched) if the reinstall fails
+        set_aside = {
+            name: self._set_aside(self.installed[name]) for name in to_install if name in self.installed
+        }
+        outcomes = await asyncio.gather(
+            *(self._install_source(name, sources[name]) for name in to_install)
+        )
+        for name, outcome in zip(to_install, outcomes):
+            self._put_back(set_aside.get(name, []), restore="error" in outcome)
+            if "error" in outcome:
+                result["errors"][name] = outcome["error"]
+                continue
+            self.installed[name] = {"method": outcome["method"], "details": outcome}
+            self._record_artifact(outcome)
+            result["installed"].append(name)
+
+        if to_remove or result["installed"]:
+            await self._save_installed()
+
+        upserts: dict[str, Any] = {}
+        removals = [
+            name
+            for name in configured
+            if name in to_remove or (name in locked and locked[name].get("configure") is False)
+        ]
+        for name, entry in locked.items():
+            if name not in self.installed or entry.get("configure") is False:
+                continue
+            desired = config_mgr.generate_server_config(self.installed[name]["details"])
+            desired.update(entry.get("config", {}))
+            if configured.get(name) != desired:
+                upserts[name] = desired
+
+        if upserts or removals:
+            await config_mgr.apply_changes(upserts, removals)
+        result["config_updated"] = sorted(upserts)
+        result["config_removed"] = sorted(removals)
+        result["changed"] = bool(to_remove or to_install or upserts or removals)
+        return result
+
+    async def export_bundle(self, path: str, names: Optional[list[str]] = None) -> dict[str, Any]:
+        """Write installed servers, their artifacts and config to one offline archive"""
+        return await BundleManager(self, MCPM_HOME, WHEEL_CACHE).export(path, names)
+
+    async def import_bundle(self, path: str, configure: bool = True) -> dict[str, Any]:
+        """Restore servers from a bundle without touching the network"""
+        return await BundleManager(self, MCPM_HOME, WHEEL_CACHE).import_(path, configure)
 
     async def cleanup(self):
         """Release resources"""
@@ -243,14 +1388,54 @@ class MCPPackageManager:
 
 
 # MCP Server Interface
-async def handle_request(request: dict[str, Any]) -> dict[str, Any]:
-    """The grand dispatcher"""
-    mcpm = MCPPackageManager()
+async def handle_request(
+    request: dict[str, Any], manager: Optional[MCPPackageManager] = None
+) -> dict[str, Any]:
+    """The grand dispatcher
+
+    A long-lived ``manager`` can be passed in to reuse cached state across
+    requests; otherwise a fresh one is created and cleaned up per request.
+    """
+    method = request.get("method", "")
+    tool = (request.get("params") or {}).get("name") if method == "tools/call" else None
+    with tracing.profile(f"{method}-{tool}" if tool else method), tracing.span(
+        "handle_request", method=method, tool=tool
+    ):
+        return await _dispatch(request, manager)
+
+
+def _paged(args: dict[str, Any]) -> bool:
+    return "cursor" in args or "limit" in args
+
+
+async def _listing(items: AsyncIterator[dict[str, Any]], args: dict[str, Any]) -> Any:
+    """The whole listing, or one page when the caller passed ``cursor`` or ``limit``"""
+    if not _paged(args):
+        return [item async for item in items]
+    try:
+        return await paginate(items, args.get("cursor"), args.get("limit"))
+    except (TypeError, ValueError) as e:
+        await items.aclose()
+        return {"error": str(e)}
+
+
+async def _dispatch(
+    request: dict[str, Any], manager: Optional[MCPPackageManager]
+) -> dict[str, Any]:
+    """Route one request to the package or config manager"""
+    mcpm = manager or MCPPackageManager()
 
     try:
         method = request.get("method", "")
         params = request.get("params", {})
 
+        if method == "initialize":
+            return {
+                "protocolVersion": params.get("protocolVersion", MCP_PROTOCOL_VERSION),
+                "capabilities": {"tools": {"listChanged": _watch_notify()}},
+                "serverInfo": {"name": "mcpm", "version": __version__},
+            }
+
         if method == "tools/list":
             return {
                 "tools": [
@@ -259,30 +1444,63 @@ async def handle_request(request: dict[str, Any]) -> dict[str, Any]:
                     {"name": "install", "description": "Install an MCP server"},
                     {"name": "uninstall", "description": "Remove an installed server"},
                     {"name": "installed", "description": "List installed servers"},
+                    {"name": "outdated", "description": "Check installed npm servers for updates"},
+                    {"name": "status", "description": "Verify installed servers and optionally repair drift"},
                     {"name": "config-add", "description": "Add installed server to MCP config"},
                     {"name": "config-remove", "description": "Remove server from MCP config"},
                     {"name": "config-list", "description": "List servers in MCP config"},
                     {"name": "config-backup", "description": "Backup current MCP config"},
+                    {"name": "config-backups", "description": "List MCP config backups"},
                     {"name": "config-restore", "description": "Restore MCP config from backup"},
+                    {"name": "config-targets", "description": "List or register MCP config targets"},
+                    {"name": "refresh", "description": "Apply registry changes since the last refresh"},
+                    {"name": "gc", "description": "Remove orphaned artifacts and trim the cache"},
+                    {"name": "lock", "description": "Write a lockfile of installed servers"},
+                    {"name": "sync", "description": "Converge servers and MCP config onto a lockfile"},
                 ]
             }
 
         elif method == "tools/call":
             tool = params.get("name")
             args = params.get("arguments", {})
+            # config-add/remove/list fan out over several config files when given targets
+            targets = args.get("targets")
+            if isinstance(targets, str):
+                targets = [targets]
 
             if tool == "list":
-                result = await mcpm.list_available()
+                result = await _listing(mcpm.iter_available(), args)
             elif tool == "search":
                 result = await mcpm.search(args.get("query", ""))
             elif tool == "install":
                 result = await mcpm.install(args.get("name", ""))
             elif tool == "uninstall":
-                result = await mcpm.uninstall(args.get("name", ""))
+                result = await mcpm.uninstall(args.get("name", ""), gc=args.get("gc"))
             elif tool == "installed":
-                result = await mcpm.list_installed()
+                result = await _listing(mcpm.iter_installed(), args)
+            elif tool == "outdated":
+                result = await mcpm.outdated()
+            elif tool == "status":
+                result = await mcpm.status(repair=bool(args.get("repair")))
+            elif tool == "refresh":
+                result = await mcpm.refresh_registry()
+            elif tool == "gc":
+                budget = args.get("budget")
+                try:
+                    if isinstance(budget, str):
+                        budget = parse_size(budget)
+                    elif budget is not None and (not isinstance(budget, int) or budget < 0):
+                        raise ValueError(f"Invalid size: {budget!r}")
+                except ValueError as e:
+                    result = {"error": str(e)}
+                else:
+                    result = await mcpm.gc(cache_budget=budget)
+            elif tool == "lock":
+                result = await mcpm.lock(args.get("path"))
+            elif tool == "sync":
+                result = await mcpm.sync(args.get("path"))
             elif tool == "config-add":
-                config_mgr = MCPConfigManager()
+                config_mgr = mcpm.config_manager
                 server_name = args.get("name", "")
 
                 await mcpm._load_installed()
@@ -297,47 +1515,114 @@ async def handle_request(request: dict[str, Any]) -> dict[str, Any]:
                     if "args" in args:
                         server_config["args"] = args["args"]
 
-                    result = await config_mgr.add_server(server_name, server_config)
+                    if targets:
+                        result = await apply_to_targets(
+                            ConfigTargets().select(targets),
+                            lambda m: m.add_server(server_name, server_config),
+                        )
+                    else:
+                        result = await config_mgr.add_server(server_name, server_config)
 
             elif tool == "config-remove":
-                config_mgr = MCPConfigManager()
-                result = await config_mgr.remove_server(args.get("name", ""))
+                if targets:
+                    result = await apply_to_targets(
+                        ConfigTargets().select(targets),
+                        lambda m: m.remove_server(args.get("name", "")),
+                    )
+                else:
+                    result = await mcpm.config_manager.remove_server(args.get("name", ""))
 
             elif tool == "config-list":
-                config_mgr = MCPConfigManager()
-                result = await config_mgr.list_configured()
+                if targets:
+                    result = await apply_to_targets(
+                        ConfigTargets().select(targets),
+                        lambda m: _listing(m.iter_configured(), args),
+                    )
+                else:
+                    result = await _listing(mcpm.config_manager.iter_configured(), args)
+
+            elif tool == "config-targets":
+                if "add" in args:
+                    result = ConfigTargets().register(args["add"], args.get("path", ""))
+                elif "remove" in args:
+                    result = ConfigTargets().unregister(args["remove"])
+                else:
+                    result = ConfigTargets().discover()
 
             elif tool == "config-backup":
-                config_mgr = MCPConfigManager()
+                config_mgr = mcpm.config_manager
                 backup_path = await config_mgr.backup_config()
                 result = {"backup": backup_path}
 
+            elif tool == "config-backups":
+                result = await _listing(mcpm.config_manager.iter_backups(), args)
+
             elif tool == "config-restore":
-                config_mgr = MCPConfigManager()
+                config_mgr = mcpm.config_manager
                 result = await config_mgr.restore_backup(args.get("backup", ""))
             else:
                 result = {"error": f"Unknown tool: {tool}"}
 
-            return {"content": [{"type": "text", "text": json.dumps(result, indent=2)}]}
+            with tracing.span("encode_response"):
+                if _paged(args):
+                    # Pages are for machines; indentation only inflates them
+                    text = json.dumps(result, separators=(",", ":"))
+                else:
+                    text = json.dumps(result, indent=2)
+                return {"content": [{"type": "text", "text": text}]}
 
     finally:
-        await mcpm.cleanup()
+        if manager is None:
+            await mcpm.cleanup()
 
     return {"error": {"code": -32601, "message": "Method not found"}}
 
 
+def _watch_notify() -> bool:
+    return os.environ.get(WATCH_NOTIFY_ENV, "") not in ("", "0", "false")
+
+
+def watch_state(mcpm: MCPPackageManager) -> FileWatcher:
+    """Invalidate exactly the caches whose backing files changed on disk"""
+    config_mgr = mcpm.config_manager
+    config_path = config_mgr.config_path.absolute() if config_mgr.config_path else None
+    notify = _watch_notify()
+
+    def on_change(paths: set[Path]):
+        if INSTALLED_DB.absolute() in paths:
+            mcpm.invalidate_installed()
+        if config_path in paths:
+            config_mgr.invalidate()
+        if notify:
+            # What the tools report changed; clients that advertised listChanged re-query
+            print(json.dumps({"jsonrpc": "2.0", "method": "notifications/tools/list_changed"}))
+            sys.stdout.flush()
+
+    watcher = FileWatcher([INSTALLED_DB, config_path], on_change)
+    watcher.start()
+    return watcher
+
+
 async def main():
     """The eternal loop"""
     logger.info("MCPM awakens...")
 
-    async for line in async_stdin():
-        try:
-            request = json.loads(line)
-            response = await handle_request(request)
-            print(json.dumps(response))
-            sys.stdout.flush()
-        except Exception as e:
-            logger.error(f"Error: {e}")
+    mcpm = MCPPackageManager(cache_state=True)
+    watcher = watch_state(mcpm)
+
+    try:
+        async for line in async_stdin():
+            try:
+                request = json.loads(line)
+                response = await handle_request(request, mcpm)
+                print(json.dumps(response))
+                sys.stdout.flush()
+            except Exception as e:
+                logger.error(f"Error: {e}")
+    finally:
+        watcher.stop()
+        await mcpm.cleanup()
+        tracing.shutdown()
 
 
 async def async_stdin():
@@ -354,24 +1639,57 @@ async def async_stdin():
         yield line.decode().strip()
 
 
+def _pop_target_flags(args: list[str]) -> tuple[list[str], list[str]]:
+    """Split --target/--all-targets flags from positional CLI args"""
+    rest, targets = [], []
+    i = 0
+    while i < len(args):
+        if args[i] == "--all-targets":
+            targets.append("all")
+        elif args[i] == "--target" and i + 1 < len(args):
+            targets.append(args[i + 1])
+            i += 1
+        else:
+            rest.append(args[i])
+        i += 1
+    return rest, targets
+
+
+def _pop_page_flags(args: list[str]) -> tuple[list[str], int, Optional[int]]:
+    """Split --offset N / --limit N from positional CLI args"""
+    rest, offset, limit = [], 0, None
+    i = 0
+    while i < len(args):
+        if args[i] in ("--offset", "--limit") and i + 1 < len(args) and args[i + 1].isdigit():
+            if args[i] == "--offset":
+                offset = int(args[i + 1])
+            else:
+                limit = int(args[i + 1])
+            i += 1
+        else:
+            rest.append(args[i])
+        i += 1
+    return rest, offset, limit
+
+
 async def cli_main():
     """CLI interface for MCPM"""
     import sys
     
     if len(sys.argv) < 2:
         print("Usage: mcpm <command> [args...]")
-        print("Commands: list, search, install, uninstall, installed, config-add, config-remove, config-list, config-backup, config-restore")
+        print("Commands: list, search, refresh, install, uninstall, installed, outdated, status, doctor, gc, lock, sync, bundle, config-add, config-remove, config-list, config-backup, config-restore, config-targets")
         return
     
     command = sys.argv[1]
     args = sys.argv[2:] if len(sys.argv) > 2 else []
+    args, offset, limit = _pop_page_flags(args)
     
     mcpm = MCPPackageManager()
     
     try:
         if command == "list":
-            result = await mcpm.list_available()
-            for server in result:
+            async for server in aslice(mcpm.iter_available(), offset, limit):
                 print(f"{server['name']}: {server['description']}")
         
         elif command == "search":
@@ -382,9 +1700,20 @@ async def cli_main():
             for server in result:
                 print(f"{server['name']}: {server['description']}")
         
+        elif command == "refresh":
+            result = await mcpm.refresh_registry()
+            if "error" in result:
+                print(f"Error: {result['error']}")
+            else:
+                print(
+                    f"✅ Registry at {result['seq']}: {result['upserted']} updated, "
+                    f"{result['deleted']} removed, {result['entries']} total "
+                    f"({result['transferred_bytes']} bytes fetched)"
+                )
+
         elif command == "install":
             if not args:
-                print("Usage: mcpm install <server_name>")
+                print("Usage: mcpm install <server_name>[@<version_range>]")
                 return
             result = await mcpm.install(args[0])
             if "error" in result:
@@ -393,27 +1722,125 @@ async def cli_main():
                 print(f"✅ Installed {args[0]}")
         
         elif command == "uninstall":
-            if not args:
-                print("Usage: mcpm uninstall <server_name>")
+            names = [a for a in args if a != "--gc"]
+            if not names:
+                print("Usage: mcpm uninstall <server_name> [--gc]")
                 return
-            result = await mcpm.uninstall(args[0])
+            result = await mcpm.uninstall(names[0], gc=True if "--gc" in args else None)
             if "error" in result:
                 print(f"Error: {result['error']}")
             else:
-                print(f"✅ Uninstalled {args[0]}")
+                print(f"✅ Uninstalled {names[0]}")
+                if "error" in result.get("gc", {}):
+                    print(f"Error: gc skipped: {result['gc']['error']}")
+                elif "gc" in result:
+                    print(f"🧹 Reclaimed {result['gc']['reclaimed_bytes']} bytes")
+
+        elif command in ("status", "doctor"):
+            result = await mcpm.status(repair=command == "doctor" or "--repair" in args)
+            for server in result["servers"]:
+                if server["ok"]:
+                    print(f"✅ {server['name']}: {server['method']}")
+                else:
+                    print(f"❌ {server['name']}: {'; '.join(server['problems'])}")
+            for name in result.get("repaired", []):
+                print(f"🔧 Repaired {name}")
+            for name, error in result.get("errors", {}).items():
+                print(f"Error repairing {name}: {error}")
+            metrics = result["scheduler"]
+            if metrics["peak_queue_depth"]:
+                longest = max(w["max_s"] for w in metrics["waits"].values())
+                print(f"⏳ Subprocess queue peaked at {metrics['peak_queue_depth']}, longest wait {longest:.2f}s")
+
+        elif command == "outdated":
+            for row in await mcpm.outdated():
+                if "error" in row:
+                    print(f"{row['name']}: {row['error']}")
+                elif row["outdated"]:
+                    print(f"{row['name']}: {row['current']} -> wanted {row['wanted']}, latest {row['latest']}")
+
+        elif command == "gc":
+            budget = None
+            if "--budget" in args:
+                index = args.index("--budget")
+                if index + 1 >= len(args):
+                    print("Usage: mcpm gc [--budget <size>]")
+                    return
+                try:
+                    budget = parse_size(args[index + 1])
+                except ValueError as e:
+                    print(f"Error: {e}")
+                    print("Usage: mcpm gc [--budget <size>]")
+                    return
+            result = await mcpm.gc(cache_budget=budget)
+            if "error" in result:
+                print(f"Error: {result['error']}")
+                return
+            for kind in ("npm", "docker", "repos", "venvs", "npm_packages", "cache"):
+                for item in result[kind]:
+                    print(f"removed {kind}: {item}")
+            print(f"🧹 Reclaimed {result['reclaimed_bytes']} bytes")
         
         elif command == "installed":
-            result = await mcpm.list_installed()
-            for server in result:
+            async for server in aslice(mcpm.iter_installed(), offset, limit):
                 print(f"{server['name']}: {server['method']}")
         
-        elif command in ["config-add", "config-remove", "config-list", "config-backup", "config-restore"]:
+        elif command == "lock":
+            result = await mcpm.lock(args[0] if args else None)
+            print(f"🔒 Locked {result['servers']} servers to {result['path']}")
+
+        elif command == "sync":
+            result = await mcpm.sync(args[0] if args else None)
+            if "error" in result:
+                print(f"Error: {result['error']}")
+                return
+            for name in result["installed"]:
+                print(f"✅ Installed {name}")
+            for name in result["removed"]:
+                print(f"✅ Uninstalled {name}")
+            for name in result["config_updated"]:
+                print(f"✅ Configured {name}")
+            for name in result["config_removed"]:
+                print(f"✅ Removed {name} from config")
+            for name, error in result["errors"].items():
+                print(f"❌ {name}: {error}")
+            if not result["changed"]:
+                print("Already in sync")
+
+        elif command == "bundle":
+            if len(args) < 2 or args[0] not in ("export", "import"):
+                print("Usage: mcpm bundle export <file> [server...] | mcpm bundle import <file> [--no-config]")
+                return
+            if args[0] == "export":
+                result = await mcpm.export_bundle(args[1], args[2:] or None)
+                if "error" in result:
+                    print(f"Error: {result['error']}")
+                    for name, error in result.get("errors", {}).items():
+                        print(f"❌ {name}: {error}")
+                else:
+                    wheels = f", {result['wheels']} wheels" if result["wheels"] else ""
+                    print(f"📦 Bundled {len(result['servers'])} servers{wheels} into {result['path']} ({result['bytes']} bytes)")
+            else:
+                result = await mcpm.import_bundle(args[1], configure="--no-config" not in args)
+                if "error" in result:
+                    print(f"Error: {result['error']}")
+                    return
+                for name in result["restored"]:
+                    print(f"✅ Restored {name}")
+                for name in result["skipped"]:
+                    print(f"⏭️  {name} already present")
+                for name, error in result["errors"].items():
+                    print(f"❌ {name}: {error}")
+
+        elif command in ["config-add", "config-remove", "config-list", "config-backup", "config-restore", "config-targets"]:
             from config_manager import MCPConfigManager
             config_mgr = MCPConfigManager()
-            
+            args, targets = _pop_target_flags(args)
+            managers = ConfigTargets().select(targets) if targets else {"": config_mgr}
+
             if command == "config-add":
                 if not args:
-                    print("Usage: mcpm config-add <server_name>")
+                    print("Usage: mcpm config-add <server_name> [--target <name|path>]... [--all-targets]")
                     return
                 await mcpm._load_installed()
                 if args[0] not in mcpm.installed:
@@ -421,20 +1848,56 @@ async def cli_main():
                     return
                 server_info = mcpm.installed[args[0]]
                 server_config = config_mgr.generate_server_config(server_info["details"])
-                result = await config_mgr.add_server(args[0], server_config)
-                print(f"✅ Added {args[0]} to MCP config" if result else f"❌ Failed to add {args[0]}")
-            
+                results = await apply_to_targets(
+                    managers, lambda m: m.add_server(args[0], server_config)
+                )
+                for target, result in results.items():
+                    where = f" ({target})" if target else ""
+                    if "error" in result:
+                        print(f"❌ Failed to add {args[0]}{where}: {result['error']}")
+                    else:
+                        print(f"✅ Added {args[0]} to MCP config{where}")
+
             elif command == "config-remove":
                 if not args:
-                    print("Usage: mcpm config-remove <server_name>")
+                    print("Usage: mcpm config-remove <server_name> [--target <name|path>]... [--all-targets]")
                     return
-                result = await config_mgr.remove_server(args[0])
-                print(f"✅ Removed {args[0]} from config" if result else f"❌ Failed to remove {args[0]}")
-            
+                results = await apply_to_targets(managers, lambda m: m.remove_server(args[0]))
+                for target, result in results.items():
+                    where = f" ({target})" if target else ""
+                    if "error" in result:
+                        print(f"❌ Failed to remove {args[0]}{where}: {result['error']}")
+                    else:
+                        print(f"✅ Removed {args[0]} from config{where}")
+
             elif command == "config-list":
-                result = await config_mgr.list_configured()
-                for server in result:
-                    print(f"{server['name']}: {server['command']} {' '.join(server.get('args', []))}")
+                results = await apply_to_targets(
+                    managers,
+                    lambda m: _collect(aslice(m.iter_configured(), offset, limit)),
+                )
+                for target, result in results.items():
+                    if target:
+                        print(f"[{target}]")
+                    if isinstance(result, dict):
+                        print(f"Error: {result['error']}")
+                        continue
+                    for server in result:
+                        print(f"{server['name']}: {server['command']} {' '.join(server.get('args', []))}")
+
+            elif command == "config-targets":
+                if args[:1] == ["add"] and len(args) == 3:
+                    result = ConfigTargets().register(args[1], args[2])
+                elif args[:1] == ["remove"] and len(args) == 2:
+                    result = ConfigTargets().unregister(args[1])
+                elif not args:
+                    for target in ConfigTargets().discover():
+                        marker = "✅" if target["exists"] else "  "
+                        print(f"{marker} {target['target']}: {target['config_path']}")
+                    return
+                else:
+                    print("Usage: mcpm config-targets [add <name> <path> | remove <name>]")
+                    return
+                print(f"Error: {result['error']}" if "error" in result else f"✅ {result['status'].capitalize()} {result['target']}")
             
             elif command == "config-backup":
                 backup_path = await config_mgr.backup_config()
@@ -443,6 +1906,8 @@ async def cli_main():
             elif command == "config-restore":
                 if not args:
                     print("Usage: mcpm config-restore <backup_file>")
+                    async for backup in aslice(config_mgr.iter_backups(), offset, limit):
+                        print(f"  {backup['name']} ({backup['size']} bytes, {backup['modified']})")
                     return
                 result = await config_mgr.restore_backup(args[0])
                 print(f"✅ Config restored" if result else f"❌ Failed to restore config")
@@ -454,11 +1919,31 @@ async def cli_main():
         await mcpm.cleanup()
 
 
+def _pop_global_flags(argv: list[str]) -> list[str]:
+    """Consume --trace <file> / --profile and configure tracing"""
+    rest, trace_path, profile_dir = [], None, None
+    i = 0
+    while i < len(argv):
+        if argv[i] == "--trace" and i + 1 < len(argv):
+            trace_path = argv[i + 1]
+            i += 1
+        elif argv[i] == "--profile":
+            profile_dir = os.environ.get(tracing.PROFILE_ENV) or str(MCPM_HOME / "profiles")
+        else:
+            rest.append(argv[i])
+        i += 1
+    tracing.configure(trace_path, profile_dir)
+    return rest
+
+
 if __name__ == "__main__":
+    sys.argv = _pop_global_flags(sys.argv)
     # Check if running as CLI or MCP server
     if len(sys.argv) > 1:
         # CLI mode
-        asyncio.run(cli_main())
+        with tracing.profile(f"cli-{sys.argv[1]}"), tracing.span("cli", command=sys.argv[1]):
+            asyncio.run(cli_main())
+        tracing.shutdown()
     else:
         # MCP server mode
         asyncio.run(main())
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+MCPM npm Registry Client - Cached abbreviated packuments and semver ranges
+Copyright 2024 James Dominguez
+Licensed under the Apache License, Version 2.0
+"""
+
+import asyncio
+import json
+import logging
+import operator
+import os
+import re
+from pathlib import Path
+from typing import Any, Optional
+from urllib.parse import quote
+
+import aiohttp
+
+logger = logging.getLogger("mcpm.npm")
+
+NPM_REGISTRY = "https://registry.npmjs.org"
+NPM_REGISTRY_ENV = "MCPM_NPM_REGISTRY"
+# Abbreviated metadata: just what an installer needs, a fraction of the full document
+ABBREVIATED_ACCEPT = "application/vnd.npm.install-v1+json; q=1.0, application/json; q=0.8"
+
+VersionKey = tuple[int, int, int, int, tuple[tuple[int, Any], ...]]
+
+_VERSION_RE = re.compile(
+    r"^\s*[v=]*\s*(\d+|[xX*])(?:\.(\d+|[xX*]))?(?:\.(\d+|[xX*]))?"
+    r"(?:-([0-9A-Za-z.-]+))?(?:\+[0-9A-Za-z.-]+)?\s*$"
+)
+_COMPARATOR_RE = re.compile(r"^(<=|>=|<|>|=|\^|~>?|)\s*(.*)$")
+
+
+def parse_version(version: str) -> Optional[VersionKey]:
+    """Sortable key for an exact semver version, or None if it isn't one"""
+    parts = _partial(version)
+    if parts is None or None in parts[:3]:
+        return None
+    return _key(parts[0], parts[1], parts[2], parts[3])
+
+
+def _partial(text: str) -> Optional[tuple[Optional[int], Optional[int], Optional[int], str]]:
+    """Parse a possibly partial version; missing or x components are None"""
+    match = _VERSION_RE.match(text)
+    if not match:
+        return None
+    nums = [None if g is None or g in "xX*" else int(g) for g in match.groups()[:3]]
+    # Anything after a wildcard is a wildcard too (1.x.3 == 1.x)
+    for i in range(1, 3):
+        if nums[i - 1] is None:
+            nums[i] = None
+    return nums[0], nums[1], nums[2], match.group(4) or ""
+
+
+def _key(major: int, minor: int, patch: int, pre: str = "") -> VersionKey:
+    """Releases sort above their prereleases; numeric identifiers below alphanumeric"""
+    ids = tuple((0, int(p)) if p.isdigit() else (1, p) for p in pre.split(".")) if pre else ()
+    return (major, minor, patch, 0 if pre else 1, ids)
+
+
+_ZERO = ((0, 0),)
+
+
+def _floor(major: int, minor: int, patch: int) -> VersionKey:
+    """The lowest possible version at major.minor.patch (i.e. X.Y.Z-0)"""
+    return _key(major, minor, patch, "0")
+
+
+def _desugar(comparator: str) -> Optional[list[tuple[str, VersionKey]]]:
+    """Turn one comparator (^1.2, ~1, >=2.0.0, 1.x, ...) into primitive bounds"""
+    op, rest = _COMPARATOR_RE.match(comparator).groups()
+    if rest in ("", "*", "x", "X"):
+        return [] if op in ("", "=", ">=", "^", "~", "~>", "<=") else None
+    parts = _partial(rest)
+    if parts is None:
+        return None
+    major, minor, patch, pre = parts
+    if major is None:
+        return []
+
+    low_minor, low_patch = minor or 0, patch or 0
+    low = _key(major, low_minor, low_patch, pre)
+
+    if op in ("~", "~>"):
+        upper = _floor(major + 1, 0, 0) if minor is None else _floor(major, minor + 1, 0)
+        return [(">=", low), ("<", upper)]
+    if op == "^":
+        if major > 0 or minor is None:
+            upper = _floor(major + 1, 0, 0)
+        elif minor > 0 or patch is None:
+            upper = _floor(0, minor + 1, 0)
+        else:
+            upper = _floor(0, 0, patch + 1)
+        return [(">=", low), ("<", upper)]
+
+    # Upper edge of a partial version: 1 -> <2.0.0-0, 1.2 -> <1.3.0-0
+    if minor is None:
+        next_up = _floor(major + 1, 0, 0)
+    elif patch is None:
+        next_up = _floor(major, minor + 1, 0)
+    else:
+        next_up = None
+
+    if op in ("", "="):
+        return [("=", low)] if next_up is None else [(">=", low), ("<", next_up)]
+    if op == ">=":
+        return [(">=", low)]
+    if op == ">":
+        return [(">", low)] if next_up is None else [(">=", next_up)]
+    if op == "<":
+        return [("<", low if pre or next_up is None else _floor(major, low_minor, low_patch))]
+    if op == "<=":
+        return [("<=", low)] if next_up is None else [("<", next_up)]
+    return None
+
+
+def _parse_range(spec: str) -> Optional[list[list[tuple[str, VersionKey]]]]:
+    """Parse a range into OR-ed sets of AND-ed primitive bounds"""
+    alternatives = []
+    for alternative in spec.split("||"):
+        alternative = alternative.strip()
+        bounds: list[tuple[str, VersionKey]] = []
+        hyphen = re.match(r"^(\S+)\s+-\s+(\S+)$", alternative)
+        if hyphen:
+            low, high = (_desugar(">=" + hyphen.group(1)), _desugar("<=" + hyphen.group(2)))
+            if low is None or high is None:
+                return None
+            bounds = low + high
+        else:
+            # Allow ">= 1.2" style spacing between operator and version
+            tokens = re.sub(r"(<=|>=|<|>|=|\^|~>?)\s+", r"\1", alternative).split()
+            for token in tokens:
+                primitive = _desugar(token)
+                if primitive is None:
+                    return None
+                bounds.extend(primitive)
+        alternatives.append(bounds)
+    return alternatives
+
+
+_OPS = {"=": operator.eq, ">=": operator.ge, ">": operator.gt, "<": operator.lt, "<=": operator.le}
+
+
+def satisfies(version: str, spec: str) -> bool:
+    """Whether an exact version satisfies an npm-style range
+
+    Like npm, prereleases only match when some comparator in the same set
+    names a prerelease of the same major.minor.patch.
+    """
+    key = parse_version(version)
+    ranges = _parse_range(spec)
+    if key is None or ranges is None:
+        return False
+    for bounds in ranges:
+        if not all(_OPS[op](key, bound) for op, bound in bounds):
+            continue
+        # Synthetic X.Y.Z-0 edges from desugaring don't opt in to prereleases
+        opted_in = any(b[3] == 0 and b[4] != _ZERO and b[:3] == key[:3] for _, b in bounds)
+        if key[3] == 0 and not opted_in:
+            continue
+        return True
+    return False
+
+
+def max_satisfying(versions: list[str], spec: str) -> Optional[str]:
+    """Highest version in the list that satisfies the range"""
+    candidates = [v for v in versions if satisfies(v, spec)]
+    return max(candidates, key=parse_version) if candidates else None
+
+
+def resolve(packument: dict[str, Any], spec: str) -> Optional[dict[str, Any]]:
+    """Pick the manifest a spec (dist-tag, exact version or range) resolves to"""
+    versions = packument.get("versions", {})
+    tags = packument.get("dist-tags", {})
+    spec = spec.strip() or "latest"
+    if spec in tags:
+        version = tags[spec]
+    elif spec in versions:
+        version = spec
+    else:
+        # Prefer the latest tag when it satisfies, as npm does
+        latest = tags.get("latest")
+        if latest in versions and satisfies(latest, spec):
+            version = latest
+        else:
+            version = max_satisfying(list(versions), spec)
+    if version is None or version not in versions:
+        return None
+    return versions[version]
+
+
+class PackumentCache:
+    """Abbreviated packuments cached on disk and revalidated with conditional requests"""
+
+    def __init__(self, cache_dir: Path, registry: Optional[str] = None):
+        self.cache_dir = Path(cache_dir)
+        self.registry = (registry or os.environ.get(NPM_REGISTRY_ENV) or NPM_REGISTRY).rstrip("/")
+
+    def _path(self, package: str) -> Path:
+        return self.cache_dir / f"{quote(package, safe='')}.json"
+
+    async def fetch(self, session: aiohttp.ClientSession, package: str) -> dict[str, Any]:
+        """Return the packument, sending If-None-Match/If-Modified-Since when cached"""
+        path = self._path(package)
+        try:
+            cached = json.loads(await asyncio.to_thread(path.read_text))
+        except (OSError, ValueError):
+            cached = None
+
+        headers = {"Accept": ABBREVIATED_ACCEPT}
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached and cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+        # Scoped names keep their @ but escape the slash, as the registry expects
+        url = f"{self.registry}/{quote(package, safe='@')}"
+        async with session.get(url, headers=headers) as resp:
+            if resp.status == 304 and cached:
+                # Touch so cache eviction sees it as recently used
+                os.utime(path)
+                return cached["packument"]
+            resp.raise_for_status()
+            packument = await resp.json(content_type=None)
+            entry = {
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+                "packument": packument,
+            }
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        await asyncio.to_thread(tmp.write_text, json.dumps(entry))
+        os.replace(tmp, path)
+        return packument
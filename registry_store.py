@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+MCPM Registry Store - A compact, memory-mapped registry snapshot
+Copyright 2024 James Dominguez
+Licensed under the Apache License, Version 2.0
+
+The snapshot is one little-endian file laid out as fixed-width columns over
+a shared string table, so opening it is an mmap and a header read rather
+than a JSON parse, and entries are only decoded when they are touched:
+
+    header      magic, row count and the offsets of each section below
+    meta        JSON, a few bytes (the changes-feed sequence marker)
+    records     ROW_FIELDS uint32s per row: name, description, source and
+                extras as (offset, length) into the string table, then flags
+    order       row numbers sorted by UTF-8 name, for binary-search lookups
+    hay index   start of each row's search text within the hay section
+    strings     UTF-8 string table; every distinct string is stored once
+    hay         lowercased "name\\0description\\n" per row, searched in place
+
+An entry's ``id`` is only flagged when it equals its name, which it nearly
+always does, and keys other than id/description/npm/docker/git are kept
+as a small JSON blob per row.
+"""
+
+import bisect
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Iterable, Iterator, Mapping, MutableMapping
+from pathlib import Path
+from typing import Any, Optional
+
+logger = logging.getLogger("mcpm.registry")
+
+MAGIC = b"MCPMREG\x01"
+HEADER = struct.Struct("<8s8I")
+ROW_FIELDS = 9
+KINDS = (None, "npm", "docker", "git")
+KIND_MASK = 0b011
+HAS_ID = 0b100
+HAS_DESCRIPTION = 0b1000
+# Rows unpacked per step when scanning the records column
+SCAN_BLOCK = 1024
+
+# array/memoryview code for a 4-byte unsigned int on this platform
+_U32 = "I" if array("I").itemsize == 4 else "L"
+
+
+def haystack(name: str, entry: Mapping[str, Any]) -> str:
+    """Lowercased search text; the NUL keeps matches from spanning fields"""
+    return f"{name}\0{entry.get('description', '')}".lower()
+
+
+def encode(entries: Iterable[tuple[str, Mapping[str, Any]]], seq: Any = None) -> bytes:
+    """Serialize (name, entry) pairs, in order, into the snapshot format"""
+    strings = bytearray()
+    interned: dict[str, tuple[int, int]] = {}
+
+    def intern(text: str) -> tuple[int, int]:
+        if text not in interned:
+            data = text.encode()
+            interned[text] = (len(strings), len(data))
+            strings.extend(data)
+        return interned[text]
+
+    records = array(_U32)
+    hay_index = array(_U32)
+    hay = bytearray()
+    names: list[bytes] = []
+    for name, entry in entries:
+        flags = 0
+        extras = dict(entry)
+        if extras.get("id") == name:
+            flags |= HAS_ID
+            del extras["id"]
+        description = (0, 0)
+        if isinstance(extras.get("description"), str):
+            flags |= HAS_DESCRIPTION
+            description = intern(extras.pop("description"))
+        source = (0, 0)
+        for kind in (1, 2, 3):
+            if isinstance(extras.get(KINDS[kind]), str):
+                flags |= kind
+                source = intern(extras.pop(KINDS[kind]))
+                break
+        extra = intern(json.dumps(extras, separators=(",", ":"))) if extras else (0, 0)
+        records.extend((*intern(name), *description, *source, *extra, flags))
+        hay_index.append(len(hay))
+        hay.extend(haystack(name, entry).replace("\n", " ").encode() + b"\n")
+        names.append(name.encode())
+
+    order = array(_U32, sorted(range(len(names)), key=names.__getitem__))
+    if sys.byteorder != "little":
+        for column in (records, order, hay_index):
+            column.byteswap()
+
+    meta = json.dumps({"seq": seq}).encode()
+    sections = [bytes(records), bytes(order), bytes(hay_index), bytes(strings), bytes(hay)]
+    offsets = []
+    position = HEADER.size + len(meta)
+    body = bytearray(meta)
+    for section in sections:
+        # Keep the uint32 columns aligned for zero-copy casts
+        padding = -position % 8
+        body.extend(b"\0" * padding)
+        position += padding
+        offsets.append(position)
+        body.extend(section)
+        position += len(section)
+    header = HEADER.pack(MAGIC, len(names), len(meta), *offsets, position)
+    return header + bytes(body)
+
+
+class RegistryStore(MutableMapping):
+    """Registry mapping backed by a snapshot buffer plus an in-memory overlay
+
+    Reads come straight from the (usually memory-mapped) buffer; changes
+    applied by refresh live in the overlay until write() folds everything
+    into a new snapshot. Iteration order matches a dict's: updated entries
+    keep their place, new ones go last.
+    """
+
+    __slots__ = (
+        "seq",
+        "_buf",
+        "_count",
+        "_records",
+        "_order",
+        "_hay_index",
+        "_strings",
+        "_hay",
+        "_hay_end",
+        "_upserts",
+        "_deleted",
+        "_new",
+    )
+
+    def __init__(self, buf: Any):
+        magic, count, meta_len, records, order, hay_index, strings, hay, total = HEADER.unpack_from(buf)
+        if magic != MAGIC or total != len(buf):
+            raise ValueError("not a registry snapshot (or truncated)")
+        self.seq = json.loads(bytes(buf[HEADER.size : HEADER.size + meta_len]))["seq"]
+        self._buf = buf
+        self._count = count
+        self._records = self._column(buf, records, count * ROW_FIELDS)
+        self._order = self._column(buf, order, count)
+        self._hay_index = self._column(buf, hay_index, count)
+        self._strings = strings
+        self._hay = hay
+        self._hay_end = total
+        self._upserts: dict[str, dict[str, Any]] = {}
+        self._deleted: set[str] = set()
+        self._new: dict[str, dict[str, Any]] = {}
+
+    @staticmethod
+    def _column(buf: Any, offset: int, length: int) -> Any:
+        data = memoryview(buf)[offset : offset + length * 4]
+        if sys.byteorder == "little":
+            return data.cast(_U32)
+        column = array(_U32, bytes(data))
+        column.byteswap()
+        return column
+
+    @classmethod
+    def from_entries(cls, entries: Mapping[str, Mapping[str, Any]], seq: Any = None) -> "RegistryStore":
+        """Build an in-memory store from a plain registry dict"""
+        return cls(encode(entries.items(), seq))
+
+    @classmethod
+    def open(cls, path: Path) -> Optional["RegistryStore"]:
+        """Map a snapshot file; None if it is missing or unreadable"""
+        try:
+            with open(path, "rb") as f:
+                if os.name == "nt":
+                    # A mapped file can't be replaced on Windows, so read it instead
+                    return cls(f.read())
+                return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except (OSError, ValueError, struct.error) as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.warning(f"Ignoring unreadable registry snapshot {path}: {e}")
+            return None
+
+    def write(self, path: Path) -> "RegistryStore":
+        """Fold the overlay into a new snapshot at path and map it"""
+        data = encode(self.items(), self.seq)
+        tmp = Path(path).with_suffix(".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        return RegistryStore.open(path) or RegistryStore(data)
+
+    # -- base snapshot access ------------------------------------------------
+
+    def _string(self, offset: int, length: int) -> str:
+        start = self._strings + offset
+        return str(self._buf[start : start + length], "utf-8")
+
+    def _fields(self, row: int) -> list[int]:
+        base = row * ROW_FIELDS
+        return self._records[base : base + ROW_FIELDS].tolist()
+
+    def _scan(self) -> Iterator[tuple[int, list[int]]]:
+        """(row, fields) for every base row, unpacking the records in blocks"""
+        records, count = self._records, self._count
+        for first in range(0, count, SCAN_BLOCK):
+            last = min(first + SCAN_BLOCK, count)
+            block = records[first * ROW_FIELDS : last * ROW_FIELDS].tolist()
+            for row in range(first, last):
+                offset = (row - first) * ROW_FIELDS
+                yield row, block[offset : offset + ROW_FIELDS]
+
+    def _name(self, row: int) -> str:
+        base = row * ROW_FIELDS
+        return self._string(self._records[base], self._records[base + 1])
+
+    def _entry(self, row: int, name: str, fields: Optional[list[int]] = None) -> dict[str, Any]:
+        _, _, desc_off, desc_len, src_off, src_len, extra_off, extra_len, flags = (
+            fields or self._fields(row)
+        )
+        entry: dict[str, Any] = {}
+        if flags & HAS_ID:
+            entry["id"] = name
+        if flags & HAS_DESCRIPTION:
+            entry["description"] = self._string(desc_off, desc_len)
+        kind = flags & KIND_MASK
+        if kind:
+            entry[KINDS[kind]] = self._string(src_off, src_len)
+        if extra_len:
+            entry.update(json.loads(self._string(extra_off, extra_len)))
+        return entry
+
+    def _row(self, name: str) -> Optional[int]:
+        """Row holding name in the base snapshot, by binary search on the order column"""
+        key = name.encode()
+        r, order = self._records, self._order
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            base = order[mid] * ROW_FIELDS
+            start = self._strings + r[base]
+            probe = self._buf[start : start + r[base + 1]]
+            if probe < key:
+                lo = mid + 1
+            elif probe > key:
+                hi = mid
+            else:
+                return order[mid]
+        return None
+
+    def _live(self, name: str) -> bool:
+        return name not in self._deleted and self._row(name) is not None
+
+    # -- mapping protocol ----------------------------------------------------
+
+    def __getitem__(self, name: str) -> dict[str, Any]:
+        if name in self._new:
+            return self._new[name]
+        if name in self._upserts:
+            return self._upserts[name]
+        row = self._row(name) if name not in self._deleted else None
+        if row is None:
+            raise KeyError(name)
+        return self._entry(row, name)
+
+    def __setitem__(self, name: str, entry: dict[str, Any]):
+        if name not in self._new and self._live(name):
+            self._upserts[name] = entry
+        else:
+            self._new[name] = entry
+
+    def __delitem__(self, name: str):
+        if name in self._new:
+            del self._new[name]
+        elif self._live(name):
+            self._upserts.pop(name, None)
+            self._deleted.add(name)
+        else:
+            raise KeyError(name)
+
+    def __contains__(self, name: object) -> bool:
+        return isinstance(name, str) and (name in self._new or self._live(name))
+
+    def __len__(self) -> int:
+        return self._count - len(self._deleted) + len(self._new)
+
+    def __iter__(self) -> Iterator[str]:
+        for name, _ in self.items():
+            yield name
+
+    def items(self) -> Iterator[tuple[str, dict[str, Any]]]:  # type: ignore[override]
+        """Entries in order, decoding each row once; safe to mutate while iterating"""
+        for row, fields in self._scan():
+            name = self._string(fields[0], fields[1])
+            if name in self._deleted:
+                continue
+            upsert = self._upserts.get(name)
+            yield name, upsert if upsert is not None else self._entry(row, name, fields)
+        for name in list(self._new):
+            entry = self._new.get(name)
+            if entry is not None:
+                yield name, entry
+
+    def summaries(self) -> Iterator[tuple[str, str]]:
+        """(name, description) in order without building entry dicts
+
+        Names are decoded a records block at a time from just the bytes of
+        the string table that block refers to, so memory stays bounded by the
+        block however large the catalog is. A description shared by many rows
+        is stored once, so it is decoded once and reused by offset.
+        """
+        buf, base = self._buf, self._strings
+        descriptions: dict[int, str] = {}
+        overlay = self._deleted or self._upserts
+        records, count = self._records, self._count
+        for first in range(0, count, SCAN_BLOCK):
+            block = records[first * ROW_FIELDS : min(first + SCAN_BLOCK, count) * ROW_FIELDS]
+            offsets, lengths = block[0::ROW_FIELDS].tolist(), block[1::ROW_FIELDS].tolist()
+            # Interned strings never overlap, so the one starting last also ends last
+            low, top = min(offsets), max(offsets)
+            high = top + max(n for o, n in zip(offsets, lengths) if o == top)
+            chunk = buf[base + low : base + high]
+            if chunk.isascii():
+                text = chunk.decode("ascii")
+                names = [text[o - low : o - low + n] for o, n in zip(offsets, lengths)]
+            else:
+                names = [str(chunk[o - low : o - low + n], "utf-8") for o, n in zip(offsets, lengths)]
+            desc_offsets, desc_lengths = block[2::ROW_FIELDS].tolist(), block[3::ROW_FIELDS].tolist()
+            for name, offset, length in zip(names, desc_offsets, desc_lengths):
+                if overlay:
+                    if name in self._deleted:
+                        continue
+                    upsert = self._upserts.get(name)
+                    if upsert is not None:
+                        yield name, upsert.get("description", "")
+                        continue
+                description = descriptions.get(offset) if length else ""
+                if description is None:
+                    description = descriptions[offset] = self._string(offset, length)
+                yield name, description
+        for name in list(self._new):
+            entry = self._new.get(name)
+            if entry is not None:
+                yield name, entry.get("description", "")
+
+    def search(self, query: str) -> Iterator[tuple[str, str]]:
+        """(name, description) of entries whose search text contains query
+
+        The base snapshot is scanned with bytes.find over the hay section, so
+        non-matching rows are never decoded.
+        """
+        needle = query.lower().replace("\n", " ").encode()
+        hits: list[tuple[int, str, str]] = []
+        position = self._hay
+        while True:
+            found = self._buf.find(needle, position, self._hay_end)
+            if not 0 <= found < self._hay_end:
+                break
+            row = bisect.bisect_right(self._hay_index, found - self._hay) - 1
+            name = self._name(row)
+            if name not in self._deleted and name not in self._upserts:
+                hits.append((row, name, self._entry(row, name).get("description", "")))
+            position = self._hay + (
+                self._hay_index[row + 1] if row + 1 < self._count else self._hay_end - self._hay
+            )
+        query = query.lower()
+        for name, entry in self._upserts.items():
+            if query in haystack(name, entry):
+                hits.append((self._row(name), name, entry.get("description", "")))
+        hits.sort(key=lambda hit: hit[0])
+        for _, name, description in hits:
+            yield name, description
+        for name, entry in list(self._new.items()):
+            if query in haystack(name, entry):
+                yield name, entry.get("description", "")
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+MCPM Subprocess Scheduler - One queue for every npm/docker/git/pip process
+Copyright 2024 James Dominguez
+Licensed under the Apache License, Version 2.0
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import functools
+import heapq
+import itertools
+import logging
+import os
+import subprocess
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Optional
+
+logger = logging.getLogger("mcpm.scheduler")
+
+# Priority classes: lower runs first
+INTERACTIVE = 0  # a user waiting on a single command
+BULK = 1  # sync, repair, bundle import/export
+BACKGROUND = 2  # gc, prewarming
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk", BACKGROUND: "background"}
+
+MAX_PROCS_ENV = "MCPM_MAX_PROCS"
+# Queue waits at least this long are logged at debug level
+SLOW_WAIT_S = 1.0
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar(
+    "mcpm_subprocess_priority", default=INTERACTIVE
+)
+
+
+@contextlib.contextmanager
+def priority(level: int):
+    """Run subprocesses started in this block (and tasks it spawns) at ``level``"""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def at_priority(level: int):
+    """Decorate an async function so the subprocesses it starts run at ``level``"""
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with priority(level):
+                return await fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def default_limits(cpus: Optional[int] = None) -> tuple[int, dict[str, int]]:
+    """Global and per-backend concurrency derived from the CPU count"""
+    cpus = cpus or os.cpu_count() or 2
+    total = int(os.environ.get(MAX_PROCS_ENV, 0)) or max(2, cpus)
+    per_backend = {
+        # npm installs are CPU and disk heavy; docker pulls saturate the network early
+        "npm": max(1, cpus // 2),
+        "docker": max(1, min(4, cpus // 2)),
+        "git": max(2, cpus),
+    }
+    return total, per_backend
+
+
+class SubprocessScheduler:
+    """Admit subprocesses by priority under global and per-backend limits
+
+    A backend is the executable name (npm, docker, git, python, ...). Waiters
+    are granted slots in priority order, then arrival order; a waiter whose
+    backend is saturated doesn't block others behind it.
+    """
+
+    def __init__(self, limit: Optional[int] = None, backend_limits: Optional[dict[str, int]] = None):
+        default_total, default_backends = default_limits()
+        self.limit = limit or default_total
+        self.backend_limits = {**default_backends, **(backend_limits or {})}
+        self._running = Counter()
+        self._running_total = 0
+        self._waiters: list[tuple[int, int, str, asyncio.Future]] = []
+        self._seq = itertools.count()
+        # priority -> [count, total seconds, max seconds] spent queued
+        self._waits: dict[int, list[float]] = {p: [0, 0.0, 0.0] for p in PRIORITY_NAMES}
+        self._peak_depth = 0
+
+    def _can_run(self, backend: str) -> bool:
+        backend_limit = self.backend_limits.get(backend, self.limit)
+        return self._running_total < self.limit and self._running[backend] < backend_limit
+
+    def _take(self, backend: str):
+        self._running_total += 1
+        self._running[backend] += 1
+
+    def _wake(self):
+        """Grant freed slots to the best waiters that can use them"""
+        kept = []
+        for entry in sorted(self._waiters):
+            _, _, backend, future = entry
+            if future.done():
+                continue
+            if self._can_run(backend):
+                self._take(backend)
+                future.set_result(None)
+            else:
+                kept.append(entry)
+        heapq.heapify(kept)
+        self._waiters = kept
+
+    async def acquire(self, backend: str, level: int) -> float:
+        """Wait for a slot; returns seconds spent queued"""
+        start = time.monotonic()
+        # Invariant: after _wake() no waiter can run, so a free slot is fair game
+        if self._can_run(backend):
+            self._take(backend)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (level, next(self._seq), backend, future))
+            self._peak_depth = max(self._peak_depth, len(self._waiters))
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Granted just as we were cancelled; hand the slot on
+                    self.release(backend)
+                raise
+        waited = time.monotonic() - start
+        stats = self._waits.setdefault(level, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += waited
+        stats[2] = max(stats[2], waited)
+        if waited >= SLOW_WAIT_S:
+            logger.debug(
+                f"{backend} waited {waited:.2f}s for a slot at {PRIORITY_NAMES.get(level, level)} priority "
+                f"({self._running_total}/{self.limit} running, {len(self._waiters)} queued)"
+            )
+        return waited
+
+    def release(self, backend: str):
+        self._running_total -= 1
+        self._running[backend] -= 1
+        self._wake()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, backend: str, level: Optional[int] = None):
+        """Hold a slot for the block, which receives the seconds spent queued"""
+        waited = await self.acquire(backend, _priority.get() if level is None else level)
+        try:
+            yield waited
+        finally:
+            self.release(backend)
+
+    async def run(
+        self, *cmd: str, level: Optional[int] = None, stats: Optional[dict[str, Any]] = None
+    ) -> tuple[int, bytes, bytes]:
+        """Run a command once admitted, returning (returncode, stdout, stderr)
+
+        ``stats``, if given, gets the admission details (``queued_s``, ``priority``).
+        """
+        level = _priority.get() if level is None else level
+        async with self.slot(Path(cmd[0]).name, level) as waited:
+            if stats is not None:
+                stats["queued_s"] = round(waited, 6)
+                stats["priority"] = PRIORITY_NAMES.get(level, str(level))
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            stdout, stderr = await proc.communicate()
+        return proc.returncode, stdout, stderr
+
+    def metrics(self) -> dict[str, Any]:
+        """Queue depth, running counts and wait times per priority class"""
+        waits = {
+            PRIORITY_NAMES.get(level, str(level)): {
+                "count": count,
+                "total_s": round(total, 6),
+                "max_s": round(longest, 6),
+            }
+            for level, (count, total, longest) in self._waits.items()
+        }
+        return {
+            "limit": self.limit,
+            "backend_limits": dict(self.backend_limits),
+            "running": dict(self._running),
+            "queue_depth": sum(1 for *_, f in self._waiters if not f.done()),
+            "peak_queue_depth": self._peak_depth,
+            "waits": waits,
+        }
+
+
+_scheduler: Optional[SubprocessScheduler] = None
+
+
+def get_scheduler() -> SubprocessScheduler:
+    """The process-wide scheduler"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = SubprocessScheduler()
+    return _scheduler
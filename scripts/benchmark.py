@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+MCPM benchmark harness
+
+    python scripts/benchmark.py cold-start <server> [--runs N] [--system-python]
+    python scripts/benchmark.py registry [--entries N] [--runs N]
+
+cold-start launches an installed server the way an MCP client would (using
+the config mcpm generates for it), sends an ``initialize`` request and times
+how long the first response takes. ``--system-python`` runs a git server with
+the bare system interpreter instead of its virtualenv, for comparison.
+
+registry builds a synthetic catalog and compares the JSON snapshot loaded
+into dicts against the memory-mapped compact store: load time, Python heap
+held after loading (tracemalloc, so the mapped file itself isn't counted),
+a listing (name and description of every entry) and a search.
+
+Copyright 2024 James Dominguez
+Licensed under the Apache License, Version 2.0
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config_manager import MCPConfigManager  # noqa: E402
+from mcpm import MCPPackageManager  # noqa: E402
+from registry_store import RegistryStore, haystack  # noqa: E402
+
+INITIALIZE = {
+    "jsonrpc": "2.0",
+    "id": 1,
+    "method": "initialize",
+    "params": {
+        "protocolVersion": "2024-11-05",
+        "capabilities": {},
+        "clientInfo": {"name": "mcpm-benchmark", "version": "0"},
+    },
+}
+
+
+async def time_launch(command: str, args: list[str], env: dict[str, str], timeout: float) -> float:
+    """Seconds from spawn until the server answers initialize"""
+    start = time.perf_counter()
+    proc = await asyncio.create_subprocess_exec(
+        command,
+        *args,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+        env={**os.environ, **env},
+    )
+    try:
+        proc.stdin.write((json.dumps(INITIALIZE) + "\n").encode())
+        await proc.stdin.drain()
+        line = await asyncio.wait_for(proc.stdout.readline(), timeout)
+        if not line:
+            raise RuntimeError(f"server exited with {await proc.wait()} before responding")
+        return time.perf_counter() - start
+    finally:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+
+
+async def cold_start(name: str, runs: int, system_python: bool, timeout: float) -> int:
+    mcpm = MCPPackageManager()
+    await mcpm._load_installed()
+    if name not in mcpm.installed:
+        print(f"Error: Server '{name}' not installed")
+        return 1
+
+    details = dict(mcpm.installed[name]["details"])
+    if system_python:
+        details.pop("python", None)
+    config = MCPConfigManager().generate_server_config(details)
+
+    samples = []
+    for _ in range(runs):
+        samples.append(
+            await time_launch(config["command"], config.get("args", []), config.get("env", {}), timeout)
+        )
+
+    print(f"{name}: {config['command']} ({runs} runs)")
+    print(f"  first:  {samples[0] * 1000:.1f} ms")
+    print(f"  median: {statistics.median(samples) * 1000:.1f} ms")
+    print(f"  min:    {min(samples) * 1000:.1f} ms")
+    return 0
+
+
+def synthetic_catalog(entries: int) -> dict[str, dict[str, str]]:
+    """A registry shaped like the real one, with the repetition real catalogs have"""
+    catalog = {}
+    for i in range(entries):
+        name = f"server-{i:06d}"
+        entry = {"id": name, "description": f"Tools for service {i % 500} and friends"}
+        if i % 10 == 9:
+            entry["docker"] = f"ghcr.io/mcp/{name}"
+        else:
+            entry["npm"] = f"@mcp/{name}"
+        catalog[name] = entry
+    return catalog
+
+
+def measure(load, runs: int) -> tuple[Any, float, int]:
+    """(result, best load seconds, Python bytes still allocated after loading)"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        load()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    result = load()
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, min(timings), held
+
+
+def timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def registry_benchmark(entries: int, runs: int) -> int:
+    catalog = synthetic_catalog(entries)
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = Path(tmp) / "registry.json"
+        json_path.write_text(json.dumps({"seq": 1, "entries": catalog}))
+        store_path = Path(tmp) / "registry.bin"
+        RegistryStore.from_entries(catalog, 1).write(store_path)
+        del catalog
+
+        def dict_listing(registry):
+            return [(n, s.get("description", "")) for n, s in registry.items()]
+
+        def dict_search(registry):
+            return [n for n, s in registry.items() if "service 42 " in haystack(n, s)]
+
+        variants = (
+            (
+                "dict (JSON)",
+                json_path,
+                lambda: json.loads(json_path.read_text())["entries"],
+                dict_listing,
+                dict_search,
+            ),
+            (
+                "compact (mmap)",
+                store_path,
+                lambda: RegistryStore.open(store_path),
+                lambda r: list(r.summaries()),
+                lambda r: list(r.search("service 42 ")),
+            ),
+        )
+        results = []
+        for label, path, load, listing, search in variants:
+            registry, load_s, held = measure(load, runs)
+            list_s = timed(lambda: listing(registry))
+            search_s = timed(lambda: search(registry))
+            results.append((label, path.stat().st_size, load_s, held, list_s, search_s))
+            del registry
+
+    print(f"registry: {entries} entries (best of {runs} loads)")
+    print(f"  {'':16} {'file':>10} {'load':>10} {'heap':>10} {'list':>10} {'search':>10}")
+    for label, size, load_s, held, list_s, search_s in results:
+        print(
+            f"  {label:16} {size / 1024:>8.0f}KB {load_s * 1000:>8.2f}ms {held / 1024:>8.0f}KB"
+            f" {list_s * 1000:>8.1f}ms {search_s * 1000:>8.1f}ms"
+        )
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="MCPM benchmarks")
+    sub = parser.add_subparsers(dest="benchmark", required=True)
+
+    cold = sub.add_parser("cold-start", help="time server launch until initialize answers")
+    cold.add_argument("server")
+    cold.add_argument("--runs", type=int, default=5)
+    cold.add_argument("--timeout", type=float, default=30.0)
+    cold.add_argument("--system-python", action="store_true")
+
+    registry = sub.add_parser("registry", help="compare registry load time and memory")
+    registry.add_argument("--entries", type=int, default=50000)
+    registry.add_argument("--runs", type=int, default=5)
+
+    opts = parser.parse_args()
+    if opts.benchmark == "cold-start":
+        return asyncio.run(cold_start(opts.server, opts.runs, opts.system_python, opts.timeout))
+    if opts.benchmark == "registry":
+        return registry_benchmark(opts.entries, opts.runs)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
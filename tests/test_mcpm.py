@@ -6,10 +6,18 @@ Copyright 2024 James Dominguez
 Licensed under the Apache License, Version 2.0
 """
 
+import asyncio
+import ensurepip
+import hashlib
+import io
 import json
 import os
+import shutil
 import subprocess
 import sys
+import tarfile
+import tracemalloc
+import zipfile
 from pathlib import Path
 from unittest.mock import AsyncMock, patch
 
@@ -18,8 +26,14 @@ import pytest
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from config_manager import MCPConfigManager
-from mcpm import MCPPackageManager, handle_request
+import mcpm as mcpm_module
+import scheduler
+import tracing
+from config_manager import ConfigTargets, MCPConfigManager
+from mcpm import MCPPackageManager, handle_request, parse_size, split_spec
+from npm_registry import max_satisfying, satisfies
+from registry_store import RegistryStore
+from watcher import FileWatcher
 
 
 @pytest.fixture
@@ -37,13 +51,31 @@ async def mcpm():
         await manager.cleanup()
 
 
+@pytest.fixture
+def isolated_home(tmp_path, monkeypatch):
+    """Point MCPM_HOME and friends at a throwaway directory"""
+    home = tmp_path / ".mcpm"
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setattr(mcpm_module, "MCPM_HOME", home)
+    monkeypatch.setattr(mcpm_module, "INSTALLED_DB", home / "installed.json")
+    monkeypatch.setattr(mcpm_module, "CACHE_DIR", home / "cache")
+    monkeypatch.setattr(mcpm_module, "ARTIFACTS_DB", home / "artifacts.json")
+    monkeypatch.setattr(mcpm_module, "VENVS_DIR", home / "venvs")
+    monkeypatch.setattr(mcpm_module, "WHEEL_CACHE", home / "cache" / "wheels")
+    monkeypatch.setattr(mcpm_module, "REGISTRY_SNAPSHOT", home / "cache" / "registry.json")
+    monkeypatch.setattr(mcpm_module, "REGISTRY_STORE", home / "cache" / "registry.bin")
+    monkeypatch.setattr(mcpm_module, "PACKUMENT_CACHE", home / "cache" / "packuments")
+    (home / "cache").mkdir(parents=True)
+    return home
+
+
 @pytest.mark.asyncio
 async def test_list_tools():
     """Test that tool listing works correctly"""
     response = await handle_request({"method": "tools/list"})
     assert "tools" in response
     tools = response["tools"]
-    assert len(tools) == 10
+    assert len(tools) == 18
     tool_names = {tool["name"] for tool in tools}
     expected_tools = {
         "list",
@@ -51,11 +83,19 @@ async def test_list_tools():
         "install",
         "uninstall",
         "installed",
+        "outdated",
+        "status",
         "config-add",
         "config-remove",
         "config-list",
         "config-backup",
+        "config-backups",
         "config-restore",
+        "config-targets",
+        "gc",
+        "refresh",
+        "lock",
+        "sync",
     }
     assert tool_names == expected_tools
 
@@ -79,11 +119,17 @@ async def test_search_functionality(mcpm):
 
 
 @pytest.mark.asyncio
-async def test_install_npm_package(mcpm):
-    """Test npm package installation"""
+@pytest.mark.parametrize("metadata", ["published", "unreachable"])
+async def test_install_npm_package(isolated_home, metadata):
+    """Test npm package installation pins and records latest, or falls back to unpinned"""
+    mcpm = MCPPackageManager()
     mcpm.registry = {"test-package": {"npm": "@test/package", "description": "Test package"}}
+    if metadata == "published":
+        resolved = AsyncMock(return_value={"version": "3.1.0", "integrity": "sha512-t"})
+    else:
+        resolved = AsyncMock(return_value={"error": "Failed to fetch metadata for @test/package"})
 
-    with patch.object(mcpm, '_fetch_registry', new_callable=AsyncMock):
+    with patch.object(mcpm, '_fetch_registry', new_callable=AsyncMock), patch.object(mcpm, "_resolve_npm", resolved):
         with patch("asyncio.create_subprocess_exec") as mock_exec:
             mock_process = AsyncMock()
             mock_process.communicate = AsyncMock(return_value=(b"", b""))
@@ -95,9 +141,16 @@ async def test_install_npm_package(mcpm):
             assert result["method"] == "npm"
             assert result["package"] == "@test/package"
             assert result["status"] == "installed"
+            resolved.assert_awaited_once_with("@test/package", "latest")
+            spec = "@test/package@3.1.0" if metadata == "published" else "@test/package"
             mock_exec.assert_called_once_with(
-                "npm", "install", "-g", "@test/package", stdout=subprocess.PIPE, stderr=subprocess.PIPE
+                "npm", "install", "-g", spec, stdout=subprocess.PIPE, stderr=subprocess.PIPE
             )
+    if metadata == "published":
+        assert (result["version"], result["integrity"]) == ("3.1.0", "sha512-t")
+        assert "spec" not in result
+    else:
+        assert "version" not in result and "integrity" not in result
 
 
 @pytest.mark.asyncio
@@ -115,12 +168,13 @@ async def test_install_already_installed(mcpm):
 
 
 @pytest.mark.asyncio
-async def test_uninstall_package(mcpm):
+async def test_uninstall_package(isolated_home):
     """Test package uninstallation"""
     # Setup installed package
-    mcpm.installed = {
-        "test-package": {"method": "git", "details": {"path": "/tmp/test_mcpm/repos/test-package"}}
-    }
+    mcpm = MCPPackageManager()
+    mcpm_module.INSTALLED_DB.write_text(
+        json.dumps({"test-package": {"method": "git", "details": {"path": "/tmp/test_mcpm/repos/test-package"}}})
+    )
 
     with patch("pathlib.Path.exists", return_value=True):
         with patch("shutil.rmtree") as mock_rmtree:
@@ -131,6 +185,958 @@ async def test_uninstall_package(mcpm):
             assert "test-package" not in mcpm.installed
 
 
+@pytest.mark.asyncio
+async def test_gc_removes_orphans_and_trims_cache(isolated_home):
+    """Test gc batches orphan removal, prunes repos and evicts LRU cache files"""
+    manager = MCPPackageManager()
+    mcpm_module.INSTALLED_DB.write_text(
+        json.dumps({"kept": {"method": "npm", "details": {"method": "npm", "package": "@a/kept"}}})
+    )
+    mcpm_module.ARTIFACTS_DB.write_text(
+        json.dumps({"npm": ["@a/kept", "@a/gone", "@a/also-gone"], "docker": []})
+    )
+    (isolated_home / "repos" / "stray").mkdir(parents=True)
+    (isolated_home / "repos" / "stray" / "server.py").write_text("x" * 10)
+    old, new = mcpm_module.CACHE_DIR / "old.bin", mcpm_module.CACHE_DIR / "new.bin"
+    old.write_bytes(b"o" * 100)
+    new.write_bytes(b"n" * 100)
+    os.utime(old, (1_000, 1_000))
+
+    calls = []
+
+    async def fake_run(*cmd):
+        calls.append(cmd)
+        return 0, b"/nonexistent\n", b""
+
+    with patch.object(manager, "_run", side_effect=fake_run):
+        result = await manager.gc(cache_budget=150)
+
+    assert ("npm", "uninstall", "-g", "@a/gone", "@a/also-gone") in calls
+    assert result["npm"] == ["@a/gone", "@a/also-gone"]
+    assert result["repos"] == ["stray"]
+    assert result["cache"] == ["old.bin"]
+    assert result["reclaimed_bytes"] == 110
+    assert not old.exists() and new.exists()
+    assert json.loads(mcpm_module.ARTIFACTS_DB.read_text())["npm"] == ["@a/kept"]
+
+
+@pytest.mark.asyncio
+async def test_gc_collects_servers_installed_before_the_ledger(isolated_home):
+    """Test uninstall --gc removes a package installed before artifacts.json existed"""
+    mcpm_module.INSTALLED_DB.write_text(
+        json.dumps(
+            {
+                "old": {"method": "npm", "details": {"package": "@a/old"}},
+                "kept": {"method": "docker", "details": {"method": "docker", "image": "ghcr.io/a/kept"}},
+            }
+        )
+    )
+    assert not mcpm_module.ARTIFACTS_DB.exists()
+    calls = []
+
+    async def fake_run(*cmd):
+        calls.append(cmd)
+        return 0, b"/nonexistent\n", b""
+
+    manager = MCPPackageManager()
+    with patch.object(manager, "_run", side_effect=fake_run):
+        result = await manager.uninstall("old", gc=True)
+    assert ("npm", "uninstall", "-g", "@a/old") in calls
+    assert result["gc"]["npm"] == ["@a/old"] and result["gc"]["docker"] == []
+    assert json.loads(mcpm_module.ARTIFACTS_DB.read_text()) == {"npm": [], "docker": ["ghcr.io/a/kept"]}
+
+
+@pytest.mark.asyncio
+async def test_gc_keeps_the_registry_snapshot(isolated_home, tmp_path, monkeypatch):
+    """Test trimming the cache never rolls a refreshed registry back to the built-ins"""
+    feed = tmp_path / "feed.json"
+    monkeypatch.setenv("MCPM_REGISTRY_FEED", str(feed))
+    feed.write_text(
+        json.dumps({"seq": 1, "changes": [{"seq": 1, "id": "custom", "entry": {"description": "Ours", "npm": "@a/custom"}}]})
+    )
+    await MCPPackageManager().refresh_registry()
+    scratch = mcpm_module.CACHE_DIR / "scratch.bin"
+    scratch.write_bytes(b"s" * 100)
+
+    result = await MCPPackageManager().gc(cache_budget=0)
+    assert result["cache"] == ["scratch.bin"]
+    assert mcpm_module.REGISTRY_STORE.exists()
+
+    manager = MCPPackageManager()
+    assert "custom" in [server["name"] for server in await manager.list_available()]
+
+    async def fake_run(*cmd):
+        return 0, b"", b""
+
+    unpublished = AsyncMock(return_value={"error": "offline"})
+    with patch.object(manager, "_run", side_effect=fake_run), patch.object(manager, "_resolve_npm", unpublished):
+        installed = await manager.install("custom")
+    assert "error" not in installed
+
+
+@pytest.mark.asyncio
+async def test_parse_size_and_bad_budgets(isolated_home, monkeypatch):
+    """Test size parsing and that malformed budgets are reported, not raised"""
+    assert parse_size("2G") == 2 * 1024**3
+    assert parse_size("512MiB") == 512 * 1024**2
+    assert parse_size("100") == 100
+    for bad in ("lots", "1.5X", "", "-1G", "nanM"):
+        with pytest.raises(ValueError):
+            parse_size(bad)
+
+    response = await handle_request(
+        {"method": "tools/call", "params": {"name": "gc", "arguments": {"budget": "1.5X"}}}
+    )
+    assert "Invalid size" in json.loads(response["content"][0]["text"])["error"]
+
+    mcpm_module.INSTALLED_DB.write_text(json.dumps({"srv": {"method": "npm", "details": {}}}))
+    monkeypatch.setenv("MCPM_CACHE_BUDGET", "lots")
+    result = await MCPPackageManager().uninstall("srv", gc=True)
+    assert result["status"] == "uninstalled"
+    assert "MCPM_CACHE_BUDGET" in result["gc"]["error"]
+
+
+@pytest.mark.asyncio
+async def test_sync_applies_minimal_diff(isolated_home, tmp_path):
+    """Test sync installs, removes and configures only what the lockfile changes"""
+    manager = MCPPackageManager()
+    mcpm_module.INSTALLED_DB.write_text(
+        json.dumps({"old": {"method": "npm", "details": {"method": "npm", "package": "@a/old"}}})
+    )
+    config_mgr = MCPConfigManager()
+    config_mgr.config = {"mcpServers": {"old": {"command": "npx"}, "mine": {"command": "x"}}}
+    await config_mgr.save_config()
+    lockfile = tmp_path / "mcpm-lock.json"
+    lockfile.write_text(
+        json.dumps(
+            {
+                "lockfileVersion": 1,
+                "servers": {
+                    "pinned": {"npm": "@a/pinned", "version": "1.2.3", "config": {"env": {"K": "v"}}},
+                    "memory": {},
+                },
+            }
+        )
+    )
+
+    with patch("asyncio.create_subprocess_exec") as mock_exec:
+        mock_process = AsyncMock()
+        mock_process.communicate = AsyncMock(return_value=(b"", b""))
+        mock_process.returncode = 0
+        mock_exec.return_value = mock_process
+
+        result = await manager.sync(str(lockfile))
+        assert sorted(result["installed"]) == ["memory", "pinned"]
+        assert result["removed"] == ["old"]
+        assert result["config_removed"] == ["old"]
+        spawned = [call.args for call in mock_exec.call_args_list]
+        assert ("npm", "install", "-g", "@a/pinned@1.2.3") in spawned
+
+        mock_exec.reset_mock()
+        again = await manager.sync(str(lockfile))
+        assert again["changed"] is False
+        mock_exec.assert_not_called()
+
+    servers = (await MCPConfigManager().load_config())["mcpServers"]
+    assert set(servers) == {"mine", "pinned", "memory"}
+    assert servers["pinned"] == {"command": "npx", "args": ["-y", "@a/pinned"], "env": {"K": "v"}}
+
+
+@pytest.mark.asyncio
+async def test_sync_keeps_servers_whose_reinstall_fails(isolated_home, tmp_path):
+    """Test a failed reinstall leaves the old install, checkout and config in place"""
+    checkout = isolated_home / "repos" / "gitsrv"
+    checkout.mkdir(parents=True)
+    (checkout / "server.py").write_text("# old")
+    installed = {
+        "fs": {"method": "npm", "details": {"method": "npm", "package": "@x/fs", "version": "1.0.0"}},
+        "gitsrv": {
+            "method": "git",
+            "details": {"method": "git", "repo": "https://x/g.git", "path": str(checkout), "commit": "aaa"},
+        },
+    }
+    mcpm_module.INSTALLED_DB.write_text(json.dumps(installed))
+    config_mgr = MCPConfigManager()
+    config_mgr.config = {"mcpServers": {"fs": {"command": "npx", "args": ["-y", "@x/fs"]}}}
+    await config_mgr.save_config()
+    lockfile = tmp_path / "mcpm-lock.json"
+    lockfile.write_text(
+        json.dumps(
+            {
+                "servers": {
+                    "fs": {"npm": "@x/fs", "version": "2.0.0"},
+                    "gitsrv": {"git": "https://x/g.git", "commit": "bbb", "configure": False},
+                }
+            }
+        )
+    )
+
+    async def failing_run(*cmd):
+        if cmd[:2] in (("npm", "install"), ("git", "clone")):
+            assert not checkout.exists()
+            return 1, b"", b"network unreachable"
+        return 0, b"", b""
+
+    manager = MCPPackageManager()
+    with patch.object(manager, "_run", side_effect=failing_run):
+        result = await manager.sync(str(lockfile))
+    assert set(result["errors"]) == {"fs", "gitsrv"}
+    assert result["removed"] == [] and result["config_removed"] == []
+    assert json.loads(mcpm_module.INSTALLED_DB.read_text()) == installed
+    assert (checkout / "server.py").read_text() == "# old"
+    assert not list(checkout.parent.glob(".*.aside"))
+    servers = (await MCPConfigManager().load_config())["mcpServers"]
+    assert servers["fs"]["args"] == ["-y", "@x/fs"]
+
+
+@pytest.mark.asyncio
+async def test_lock_pins_exact_artifacts_and_sync_honours_them(isolated_home, tmp_path):
+    """Test lock records version/integrity/digest/commit and sync reinstalls exactly those"""
+    repo_path = isolated_home / "repos" / "gitsrv"
+    installed = {
+        "npmsrv": {
+            "method": "npm",
+            "details": {"method": "npm", "package": "@a/n", "version": "1.0.0", "integrity": "sha512-abc"},
+        },
+        "loose": {"method": "npm", "details": {"method": "npm", "package": "@a/loose"}},
+        "img": {"method": "docker", "details": {"method": "docker", "image": "ghcr.io/a/img:1"}},
+        "gitsrv": {"method": "git", "details": {"method": "git", "repo": "https://x/g.git", "path": str(repo_path)}},
+    }
+    mcpm_module.INSTALLED_DB.write_text(json.dumps(installed))
+    calls = []
+
+    async def fake_run(*cmd):
+        calls.append(cmd)
+        if cmd[:2] == ("npm", "ls"):
+            return 0, json.dumps({"dependencies": {"@a/loose": {"version": "2.1.0"}}}).encode(), b""
+        if cmd[:3] == ("docker", "image", "inspect"):
+            info = {"Id": "sha256:i", "RepoTags": ["ghcr.io/a/img:1"], "RepoDigests": ["ghcr.io/a/img@sha256:d1"]}
+            return 0, json.dumps([info]).encode(), b""
+        if cmd[-2:] == ("rev-parse", "HEAD"):
+            return 0, b"c0ffee\n", b""
+        return 0, b"", b""
+
+    manager = MCPPackageManager()
+    lockfile = tmp_path / "mcpm-lock.json"
+    with patch.object(manager, "_run", side_effect=fake_run):
+        await manager.lock(str(lockfile))
+    servers = json.loads(lockfile.read_text())["servers"]
+    assert servers["npmsrv"] == {"npm": "@a/n", "version": "1.0.0", "integrity": "sha512-abc", "configure": False}
+    assert servers["loose"]["version"] == "2.1.0"
+    assert servers["img"]["digest"] == "sha256:d1"
+    assert servers["gitsrv"]["commit"] == "c0ffee"
+
+    # The same machine is already in sync
+    calls.clear()
+    with patch.object(manager, "_run", side_effect=fake_run):
+        assert (await manager.sync(str(lockfile)))["changed"] is False
+    assert calls == []
+
+    # A fresh machine gets exactly the pinned artifacts
+    mcpm_module.INSTALLED_DB.write_text("{}")
+    fresh = MCPPackageManager()
+    published = AsyncMock(return_value={"version": "1.0.0", "integrity": "sha512-abc"})
+    with patch.object(fresh, "_run", side_effect=fake_run), patch.object(fresh, "_resolve_npm", published):
+        result = await fresh.sync(str(lockfile))
+    assert sorted(result["installed"]) == ["gitsrv", "img", "loose", "npmsrv"]
+    assert ("npm", "install", "-g", "@a/loose@2.1.0") in calls
+    assert ("docker", "pull", "ghcr.io/a/img@sha256:d1") in calls
+    assert ("docker", "tag", "ghcr.io/a/img@sha256:d1", "ghcr.io/a/img:1") in calls
+    assert ("git", "-C", str(repo_path), "checkout", "--quiet", "--detach", "c0ffee") in calls
+
+    # A registry that no longer matches the locked integrity is refused
+    mcpm_module.INSTALLED_DB.write_text("{}")
+    tampered = AsyncMock(return_value={"version": "1.0.0", "integrity": "sha512-other"})
+    fresh = MCPPackageManager()
+    with patch.object(fresh, "_run", side_effect=fake_run), patch.object(fresh, "_resolve_npm", tampered):
+        result = await fresh.sync(str(lockfile))
+    assert "Integrity mismatch" in result["errors"]["npmsrv"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("use_inotify", [True, False])
+async def test_file_watcher_debounces_changes(tmp_path, use_inotify):
+    """Test the watcher batches rapid edits and atomic replaces into one callback"""
+    watched, other = tmp_path / "installed.json", tmp_path / "other.json"
+    watched.write_text("{}")
+    batches = []
+    watcher = FileWatcher(
+        [watched], batches.append, debounce=0.05, poll_interval=0.02, use_inotify=use_inotify
+    )
+    watcher.start()
+    try:
+        await asyncio.sleep(0.05)
+        watched.write_text('{"a": 1}')
+        other.write_text("ignored")
+        (tmp_path / "tmp.json").write_text('{"a": 2, "b": 2}')
+        os.replace(tmp_path / "tmp.json", watched)
+        await asyncio.sleep(0.3)
+    finally:
+        watcher.stop()
+
+    assert batches == [{watched.absolute()}]
+
+
+@pytest.mark.asyncio
+async def test_watch_notify_advertises_and_emits_list_changed(isolated_home, monkeypatch, capsys):
+    """Test MCPM_WATCH_NOTIFY advertises listChanged and emits it on file changes"""
+    monkeypatch.setenv("MCPM_WATCH_NOTIFY", "1")
+    init = await handle_request({"method": "initialize", "params": {}})
+    assert init["capabilities"]["tools"]["listChanged"] is True
+
+    manager = MCPPackageManager(cache_state=True)
+    watcher = mcpm_module.watch_state(manager)
+    try:
+        await asyncio.sleep(0.1)
+        mcpm_module.INSTALLED_DB.write_text('{"x": {"method": "npm", "details": {}}}')
+        for _ in range(50):
+            await asyncio.sleep(0.1)
+            if "list_changed" in capsys.readouterr().out:
+                break
+        else:
+            pytest.fail("no notifications/tools/list_changed emitted")
+    finally:
+        watcher.stop()
+
+
+@pytest.mark.asyncio
+async def test_cached_state_reloads_after_invalidation(isolated_home):
+    """Test server-mode caching skips re-reads until the watcher invalidates"""
+    manager = MCPPackageManager(cache_state=True)
+    await manager._load_installed()
+    mcpm_module.INSTALLED_DB.write_text(json.dumps({"x": {"method": "npm", "details": {}}}))
+
+    await manager._load_installed()
+    assert manager.installed == {}
+
+    manager.invalidate_installed()
+    await manager._load_installed()
+    assert "x" in manager.installed
+
+
+@pytest.mark.asyncio
+async def test_install_git_builds_venv_from_wheel_cache(isolated_home):
+    """Test a Python git server gets a venv, warming the wheel cache on a miss"""
+    manager = MCPPackageManager()
+    commands = []
+
+    async def fake_exec(*cmd, **kwargs):
+        commands.append(cmd)
+        if cmd[:2] == ("git", "clone"):
+            Path(cmd[3]).mkdir(parents=True)
+            (Path(cmd[3]) / "requirements.txt").write_text("mcp\n")
+        process = AsyncMock()
+        process.communicate = AsyncMock(return_value=(b"", b""))
+        # The first offline install misses the cold wheel cache
+        offline_installs = [c for c in commands if "install" in c and "--no-index" in c]
+        process.returncode = 1 if "--no-index" in cmd and len(offline_installs) == 1 else 0
+        return process
+
+    with patch("asyncio.create_subprocess_exec", side_effect=fake_exec):
+        result = await manager._install_git("pyserver", "https://example.com/pyserver.git")
+
+    venv = isolated_home / "venvs" / "pyserver"
+    assert result["venv"] == str(venv)
+    assert result["python"] == str(venv / "bin" / "python")
+    steps = [c[c.index("-m") + 1] if "-m" in c else c[0] for c in commands]
+    assert steps == ["git", "git", "venv", "pip", "pip", "pip", "compileall"]
+    assert "wheel" in commands[4] and "--no-index" in commands[5]
+
+    config = MCPConfigManager().generate_server_config(result)
+    assert config["command"] == result["python"]
+
+
+@pytest.mark.asyncio
+async def test_install_git_project_seeds_build_backend(isolated_home, tmp_path):
+    """Test a pyproject server builds offline once its build backend is in the wheel cache"""
+    bundled = Path(ensurepip.__file__).parent / "_bundled"
+    setuptools_wheels = sorted(bundled.glob("setuptools-*.whl"))
+    if not setuptools_wheels:
+        pytest.skip("no bundled setuptools wheel")
+    repo = tmp_path / "proj"
+    (repo / "proj").mkdir(parents=True)
+    (repo / "proj" / "__init__.py").write_text("")
+    (repo / "pyproject.toml").write_text(
+        '[build-system]\nrequires = ["setuptools>=61"]\nbuild-backend = "setuptools.build_meta"\n\n'
+        '[project]\nname = "proj"\nversion = "0.1"\n'
+    )
+    assert mcpm_module.build_requirements(repo) == ["setuptools>=61"]
+    assert mcpm_module.build_requirements(tmp_path) == mcpm_module.DEFAULT_BUILD_REQUIRES
+
+    # Cold path: the miss caches the backend alongside the project's wheels
+    manager = MCPPackageManager()
+    commands = []
+
+    async def fake_exec(*cmd, **kwargs):
+        commands.append(cmd)
+        process = AsyncMock()
+        process.communicate = AsyncMock(return_value=(b"", b""))
+        process.returncode = 1 if "--no-index" in cmd and len(commands) == 2 else 0
+        return process
+
+    with patch("asyncio.create_subprocess_exec", side_effect=fake_exec):
+        await manager._build_venv("proj", repo)
+    wheel = commands[2]
+    assert "wheel" in wheel and wheel[-2:] == ("setuptools>=61", str(repo))
+
+    # Warm path, for real and with no index: the isolated build finds setuptools
+    mcpm_module.WHEEL_CACHE.mkdir(parents=True, exist_ok=True)
+    shutil.copy(setuptools_wheels[-1], mcpm_module.WHEEL_CACHE)
+    result = await manager._build_venv("proj", repo)
+    assert "venv_error" not in result
+    check = subprocess.run([result["python"], "-c", "import proj"], capture_output=True)
+    assert check.returncode == 0
+
+
+@pytest.mark.asyncio
+async def test_refresh_registry_applies_deltas(isolated_home, tmp_path, monkeypatch):
+    """Test refresh applies only changes past the stored marker from a local feed"""
+    feed = tmp_path / "feed.json"
+    monkeypatch.setenv("MCPM_REGISTRY_FEED", str(feed))
+    feed.write_text(
+        json.dumps(
+            {
+                "seq": 2,
+                "changes": [
+                    {"seq": 1, "id": "alpha", "entry": {"description": "First", "npm": "@a/alpha"}},
+                    {"seq": 2, "id": "beta", "entry": {"description": "Second", "npm": "@a/beta"}},
+                ],
+            }
+        )
+    )
+    manager = MCPPackageManager()
+    first = await manager.refresh_registry()
+    assert (first["upserted"], first["deleted"], first["entries"]) == (2, 0, 2)
+
+    feed.write_text(
+        json.dumps(
+            {
+                "seq": 4,
+                "changes": [
+                    {"seq": 2, "id": "beta", "entry": {"description": "stale"}},
+                    {"seq": 3, "id": "alpha", "deleted": True},
+                    {"seq": 4, "id": "gamma", "entry": {"description": "Third second"}},
+                ],
+            }
+        )
+    )
+    second = await manager.refresh_registry()
+    assert (second["seq"], second["upserted"], second["deleted"]) == (4, 1, 1)
+    assert [r["name"] for r in await manager.search("second")] == ["beta", "gamma"]
+
+    fresh = MCPPackageManager()
+    assert [s["name"] for s in await fresh.list_available()] == ["beta", "gamma"]
+    assert fresh.registry["beta"]["description"] == "Second"
+
+
+@pytest.mark.asyncio
+async def test_registry_store_roundtrip_and_migration(isolated_home):
+    """Test the compact store matches the dict registry and replaces JSON snapshots"""
+    entries = {
+        "alpha": {"id": "alpha", "description": "Shared words", "npm": "@a/alpha"},
+        "beta": {"id": "beta", "description": "Shared words", "docker": "ghcr.io/b"},
+        "gamma": {"description": "Multi\nline ünïcode", "git": "https://x/g", "env": {"K": "v"}},
+        "delta": {"id": "other-id"},
+    }
+    mcpm_module.REGISTRY_SNAPSHOT.write_text(json.dumps({"seq": 7, "entries": entries}))
+
+    manager = MCPPackageManager()
+    await manager._fetch_registry()
+    assert isinstance(manager.registry, RegistryStore)
+    assert dict(manager.registry.items()) == entries
+    assert list(manager.registry) == list(entries)
+    assert not mcpm_module.REGISTRY_SNAPSHOT.exists()
+    assert manager._registry_seq == 7
+    assert [r["name"] for r in await manager.search("SHARED")] == ["alpha", "beta"]
+    assert [r["name"] for r in await manager.search("line ün")] == ["gamma"]
+    assert "delta" in manager.registry and "epsilon" not in manager.registry
+    described = [(n, e.get("description", "")) for n, e in entries.items()]
+    assert list(manager.registry.summaries()) == described
+    ascii_only = RegistryStore.from_entries({n: {**e, "description": "Same"} for n, e in entries.items()})
+    assert list(ascii_only.summaries()) == [(n, "Same") for n in entries]
+
+    # Overlay edits keep dict ordering and survive a rewrite
+    store = manager.registry
+    store["beta"] = {"id": "beta", "description": "Rewritten"}
+    del store["alpha"]
+    store["epsilon"] = {"description": "Shared too"}
+    assert [name for name, _ in store.search("shared")] == ["epsilon"]
+    assert list(store.summaries()) == [(n, e.get("description", "")) for n, e in store.items()]
+    reopened = store.write(mcpm_module.REGISTRY_STORE)
+    assert list(reopened) == ["beta", "gamma", "delta", "epsilon"]
+    assert reopened["beta"] == {"id": "beta", "description": "Rewritten"}
+    assert reopened["gamma"]["env"] == {"K": "v"}
+
+
+@pytest.mark.asyncio
+async def test_registry_page_memory_is_bounded(isolated_home):
+    """Test a listing page decodes only its block, not the whole string table"""
+    entries = {
+        f"server-{i:06d}": {"id": f"server-{i:06d}", "description": f"Tools for service {i}", "npm": f"@m/s{i}"}
+        for i in range(50000)
+    }
+    RegistryStore.from_entries(entries).write(mcpm_module.REGISTRY_STORE)
+    del entries
+    manager = MCPPackageManager()
+    await manager._fetch_registry()
+
+    tracemalloc.start()
+    try:
+        request = {"method": "tools/call", "params": {"name": "list", "arguments": {"limit": 10}}}
+        response = await handle_request(request, manager)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert len(json.loads(response["content"][0]["text"])["items"]) == 10
+    # The string table alone is ~2.2 MB here; a page needs one records block of it
+    assert peak < 1024 * 1024
+
+
+def test_semver_ranges():
+    """Test npm range semantics used for pinned installs"""
+    assert satisfies("1.4.2", "^1.2.0") and not satisfies("2.0.0", "^1.2.0")
+    assert satisfies("0.2.9", "^0.2.3") and not satisfies("0.3.0", "^0.2.3")
+    assert satisfies("1.2.9", "~1.2.3") and not satisfies("1.3.0", "~1.2")
+    assert satisfies("1.5.0", "1.0.0 - 1.x") and satisfies("3.1.0", "^1 || >= 3")
+    assert not satisfies("1.3.0-beta.1", "^1.2.0") and satisfies("1.3.0-beta.2", "^1.3.0-beta.1")
+    assert max_satisfying(["1.0.0", "1.10.0", "1.9.0", "2.0.0-rc.1"], "1") == "1.10.0"
+    assert split_spec("memory@^1.2") == ("memory", "^1.2") and split_spec("memory") == ("memory", None)
+
+
+@pytest.mark.asyncio
+async def test_pinned_install_and_outdated(isolated_home, monkeypatch):
+    """Test name@range resolves from cached abbreviated packuments"""
+    from aiohttp import web
+
+    requests = []
+    packument = {
+        "name": "@a/srv",
+        "dist-tags": {"latest": "2.0.0"},
+        "versions": {
+            v: {"version": v, "dist": {"integrity": f"sha512-{v}"}}
+            for v in ("1.0.0", "1.4.0", "2.0.0")
+        },
+    }
+
+    async def serve(request):
+        requests.append((request.raw_path, request.headers.get("Accept", ""), request.headers.get("If-None-Match")))
+        if request.headers.get("If-None-Match") == '"v1"':
+            return web.Response(status=304)
+        return web.json_response(packument, headers={"ETag": '"v1"'})
+
+    app = web.Application()
+    app.router.add_get("/{name:.+}", serve)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    monkeypatch.setenv("MCPM_NPM_REGISTRY", f"http://127.0.0.1:{port}")
+
+    manager = MCPPackageManager()
+    manager.registry = {"srv": {"npm": "@a/srv"}}
+    try:
+        with patch.object(manager, "_fetch_registry", new_callable=AsyncMock):
+            with patch("asyncio.create_subprocess_exec") as mock_exec:
+                mock_process = AsyncMock()
+                mock_process.communicate = AsyncMock(return_value=(b"", b""))
+                mock_process.returncode = 0
+                mock_exec.return_value = mock_process
+
+                result = await manager.install("srv@^1.0.0")
+                mock_exec.assert_called_once_with(
+                    "npm", "install", "-g", "@a/srv@1.4.0",
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                )
+        assert (result["version"], result["integrity"], result["spec"]) == ("1.4.0", "sha512-1.4.0", "^1.0.0")
+        assert manager.installed["srv"]["details"]["version"] == "1.4.0"
+
+        rows = await manager.outdated()
+    finally:
+        await manager.cleanup()
+        await runner.cleanup()
+
+    assert rows == [
+        {"name": "srv", "package": "@a/srv", "current": "1.4.0", "spec": "^1.0.0",
+         "wanted": "1.4.0", "latest": "2.0.0", "outdated": True}
+    ]
+    assert [(path, etag) for path, _, etag in requests] == [("/@a%2Fsrv", None), ("/@a%2Fsrv", '"v1"')]
+    assert all("application/vnd.npm.install-v1+json" in accept for _, accept, _ in requests)
+
+
+@pytest.mark.asyncio
+async def test_status_batches_checks_and_repairs(isolated_home):
+    """Test status uses one call per backend and reinstalls what drifted"""
+    manager = MCPPackageManager()
+    installed = {
+        f"npm{i}": {"method": "npm", "details": {"method": "npm", "package": f"@a/p{i}"}}
+        for i in range(5)
+    }
+    installed["img"] = {"method": "docker", "details": {"method": "docker", "image": "ghcr.io/a/img"}}
+    installed["repo"] = {
+        "method": "git",
+        "details": {"method": "git", "repo": "r", "path": str(isolated_home / "repos" / "repo")},
+    }
+    mcpm_module.INSTALLED_DB.write_text(json.dumps(installed))
+
+    calls = []
+
+    async def fake_run(*cmd):
+        calls.append(cmd)
+        if cmd[:2] == ("npm", "ls"):
+            deps = {f"@a/p{i}": {"version": "1.0.0"} for i in range(4)}
+            return 0, json.dumps({"dependencies": deps}).encode(), b""
+        if cmd[:3] == ("docker", "image", "inspect"):
+            return 0, json.dumps([{"Id": "sha256:x", "RepoTags": ["ghcr.io/a/img:latest"]}]).encode(), b""
+        return 128, b"", b"not a git repository"
+
+    with patch.object(manager, "_run", side_effect=fake_run):
+        result = await manager.status()
+    assert sorted(result["drifted"]) == ["npm4", "repo"]
+    assert [c[:2] for c in calls].count(("npm", "ls")) == 1
+    assert [c[:2] for c in calls].count(("docker", "image")) == 1
+    assert {"queue_depth", "peak_queue_depth", "waits"} <= set(result["scheduler"])
+
+    reinstall = AsyncMock(return_value={"method": "npm", "package": "@a/p4", "status": "installed"})
+    with patch.object(manager, "_run", side_effect=fake_run):
+        with patch.object(manager, "_install_source", reinstall):
+            repaired = await manager.status(repair=True)
+    assert sorted(repaired["repaired"]) == ["npm4", "repo"]
+    reinstall.assert_any_call("npm4", {"npm": "@a/p4"})
+
+
+@pytest.mark.asyncio
+async def test_repair_fixes_checkouts_in_place_and_keeps_them_on_failure(isolated_home):
+    """Test repair only re-clones a checkout it can't fix, and keeps it if that fails"""
+    repos = isolated_home / "repos"
+    for name in ("moved", "novenv", "broken"):
+        (repos / name).mkdir(parents=True)
+        (repos / name / "server.py").write_text(f"# {name}")
+
+    def git(name, commit="c1"):
+        path = str(repos / name)
+        details = {"method": "git", "repo": f"https://x/{name}.git", "path": path, "commit": commit}
+        return {"method": "git", "details": details}
+
+    installed = {"moved": git("moved"), "novenv": git("novenv"), "broken": git("broken")}
+    installed["novenv"]["details"]["python"] = str(isolated_home / "venvs" / "novenv" / "bin" / "python")
+    mcpm_module.INSTALLED_DB.write_text(json.dumps(installed))
+    calls = []
+
+    async def fake_run(*cmd):
+        calls.append(cmd)
+        if cmd[-2:] == ("rev-parse", "HEAD"):
+            if "broken" in cmd[2]:
+                return 128, b"", b"not a git repository"
+            moved_back = ("git", "-C", cmd[2], "checkout", "--quiet", "--detach", "c1") in calls
+            return 0, b"c1\n" if "novenv" in cmd[2] or moved_back else b"c0\n", b""
+        if cmd[:2] == ("git", "clone"):
+            return 1, b"", b"network unreachable"
+        return 0, b"", b""
+
+    manager = MCPPackageManager()
+    venv = AsyncMock(return_value={"venv": "v", "python": "v/bin/python"})
+    with patch.object(manager, "_run", side_effect=fake_run), patch.object(manager, "_build_venv", venv):
+        result = await manager.status(repair=True)
+    assert sorted(result["drifted"]) == ["broken", "moved", "novenv"]
+    assert sorted(result["repaired"]) == ["moved", "novenv"]
+    assert "network unreachable" in result["errors"]["broken"]
+    assert [c[:2] for c in calls].count(("git", "clone")) == 1
+    for name in ("moved", "novenv", "broken"):
+        assert (repos / name / "server.py").read_text() == f"# {name}"
+    assert manager.installed["moved"]["details"]["commit"] == "c1"
+    assert manager.installed["broken"] == installed["broken"]
+
+
+@pytest.mark.asyncio
+async def test_bundle_roundtrip_skips_present_and_verifies(isolated_home, tmp_path):
+    """Test a bundle restores offline, skips what's present and rejects tampering"""
+    npm_root = tmp_path / "npm-root"
+    (npm_root / "@a" / "srv" / "node_modules" / "dep").mkdir(parents=True)
+    (npm_root / "@a" / "srv" / "index.js").write_text("// server")
+    installed = {
+        "srv": {"method": "npm", "details": {"method": "npm", "package": "@a/srv", "version": "1.0.0"}},
+        "img": {"method": "docker", "details": {"method": "docker", "image": "ghcr.io/a/img"}},
+    }
+    mcpm_module.INSTALLED_DB.write_text(json.dumps(installed))
+    config_mgr = MCPConfigManager()
+    config_mgr.config = {"mcpServers": {"srv": {"command": "npx", "args": ["-y", "@a/srv"]}}}
+    await config_mgr.save_config()
+
+    calls = []
+
+    async def fake_run(*cmd):
+        calls.append(cmd)
+        if cmd[:3] == ("npm", "root", "-g"):
+            return 0, f"{npm_root}\n".encode(), b""
+        if cmd[:2] == ("docker", "save"):
+            Path(cmd[3]).write_bytes(b"image layers")
+            return 0, b"", b""
+        if cmd[:3] == ("docker", "image", "inspect"):
+            return 0, json.dumps([{"Id": "sha256:x", "RepoTags": ["ghcr.io/a/img:latest"]}]).encode(), b""
+        if cmd[:2] == ("npm", "ls"):
+            return 0, b'{"dependencies": {}}', b""
+        return 0, b"", b""
+
+    bundle_path = tmp_path / "fleet.tar"
+    exporter = MCPPackageManager()
+    with patch.object(exporter, "_run", side_effect=fake_run):
+        exported = await exporter.export_bundle(str(bundle_path))
+    assert exported["servers"] == ["img", "srv"]
+    assert exported["artifacts"] == 2
+
+    # A fresh machine: nothing installed or configured, the image already loaded
+    mcpm_module.INSTALLED_DB.write_text("{}")
+    config_mgr.config = {"mcpServers": {}}
+    await config_mgr.save_config()
+    calls.clear()
+    importer = MCPPackageManager()
+    with patch.object(importer, "_run", side_effect=fake_run):
+        result = await importer.import_bundle(str(bundle_path))
+    assert result["restored"] == ["srv"]
+    assert result["skipped"] == ["img"]
+    assert not any(c[:2] == ("docker", "load") for c in calls)
+    install = next(c for c in calls if c[:2] == ("npm", "install"))
+    assert "--offline" in install
+    restored_dir = isolated_home / "npm-packages" / "srv"
+    assert (restored_dir / "node_modules" / "dep").is_dir()
+    assert importer.installed["srv"]["details"]["bundle_sha256"]
+    assert set(json.loads(mcpm_module.INSTALLED_DB.read_text())) == {"srv", "img"}
+    servers = (await MCPConfigManager().load_config())["mcpServers"]
+    assert servers["srv"]["args"] == ["-y", "@a/srv"]
+
+    # The restored package is ledgered for gc, and its unpacked tree goes with it
+    assert "@a/srv" in json.loads(mcpm_module.ARTIFACTS_DB.read_text())["npm"]
+    stray = isolated_home / "npm-packages" / "gone"
+    stray.mkdir()
+    with patch.object(importer, "_run", side_effect=fake_run):
+        assert (await importer.gc())["npm_packages"] == ["gone"]
+        await importer.uninstall("srv")
+    assert not restored_dir.exists()
+    mcpm_module.INSTALLED_DB.write_text("{}")
+
+    # Tampered artifact: the hash check refuses it
+    tampered = tmp_path / "tampered.tar"
+    with tarfile.open(bundle_path) as src, tarfile.open(tampered, "w") as dst:
+        for member in src:
+            data = src.extractfile(member).read()
+            if member.name.startswith("npm/"):
+                data = data[:-1] + b"!"
+            dst.addfile(member, io.BytesIO(data))
+    mcpm_module.INSTALLED_DB.write_text("{}")
+    importer = MCPPackageManager()
+    with patch.object(importer, "_run", side_effect=fake_run):
+        result = await importer.import_bundle(str(tampered), configure=False)
+    assert "srv" in result["errors"]
+    assert "srv" not in importer.installed
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("data_filter", [True, False])
+async def test_bundle_refuses_links_out_of_the_package(isolated_home, tmp_path, monkeypatch, data_filter):
+    """Test a symlink in an npm artifact can't redirect extraction outside it"""
+    if not data_filter:
+        monkeypatch.delattr(tarfile, "data_filter", raising=False)
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    artifact = tmp_path / "evil.tar"
+    with tarfile.open(artifact, "w") as tar:
+        link = tarfile.TarInfo("package/link")
+        link.type, link.linkname = tarfile.SYMTYPE, str(outside)
+        tar.addfile(link)
+        payload = tarfile.TarInfo("package/link/x")
+        payload.size = 5
+        tar.addfile(payload, io.BytesIO(b"owned"))
+    digest = hashlib.sha256(artifact.read_bytes()).hexdigest()
+    manifest = {
+        "bundleVersion": 1,
+        "servers": {"evil": {"method": "npm", "details": {"method": "npm", "package": "@e/evil"}}},
+        "artifacts": [{"server": "evil", "kind": "npm", "path": "npm/evil.tar", "sha256": digest}],
+    }
+    bundle_path = tmp_path / "evil-bundle.tar"
+    with tarfile.open(bundle_path, "w") as tar:
+        data = json.dumps(manifest).encode()
+        info = tarfile.TarInfo("manifest.json")
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+        tar.add(artifact, arcname="npm/evil.tar")
+
+    async def fake_run(*cmd):
+        return 0, b'{"dependencies": {}}', b""
+
+    manager = MCPPackageManager()
+    with patch.object(manager, "_run", side_effect=fake_run):
+        result = await manager.import_bundle(str(bundle_path), configure=False)
+    assert "evil" in result["errors"] and result["restored"] == []
+    assert not (outside / "x").exists()
+    assert not list((isolated_home / "npm-packages").iterdir())
+
+
+def _fake_wheel(directory, name, version, requires=()):
+    wheel = directory / f"{name}-{version}-py3-none-any.whl"
+    metadata = f"Name: {name}\nVersion: {version}\n" + "".join(f"Requires-Dist: {r}\n" for r in requires)
+    with zipfile.ZipFile(wheel, "w") as zf:
+        zf.writestr(f"{name}-{version}.dist-info/METADATA", metadata)
+    return wheel
+
+
+@pytest.mark.asyncio
+async def test_bundle_carries_wheels_for_git_venvs(isolated_home, tmp_path):
+    """Test git servers' wheels travel with the bundle and venv failures aren't restored"""
+    repo = isolated_home / "repos" / "py"
+    repo.mkdir(parents=True)
+    (repo / "requirements.txt").write_text("mcp\n")
+    venv = isolated_home / "venvs" / "py"
+    (venv / "lib" / "python3.11" / "site-packages" / "mcp-1.0.dist-info").mkdir(parents=True)
+    cache = mcpm_module.WHEEL_CACHE
+    cache.mkdir(parents=True)
+    _fake_wheel(cache, "mcp", "1.0", ["anyio>=4", 'rich; extra == "cli"'])
+    _fake_wheel(cache, "mcp", "0.9")
+    _fake_wheel(cache, "anyio", "4.0")
+    _fake_wheel(cache, "rich", "13.0")
+    details = {"method": "git", "repo": "https://example.com/py.git", "path": str(repo), "venv": str(venv)}
+    mcpm_module.INSTALLED_DB.write_text(json.dumps({"py": {"method": "git", "details": details}}))
+
+    async def fake_run(*cmd):
+        if "bundle" in cmd:
+            Path(cmd[cmd.index("create") + 1]).write_bytes(b"git objects")
+        if cmd[:2] == ("git", "clone"):
+            Path(cmd[3]).mkdir(parents=True)
+            (Path(cmd[3]) / "requirements.txt").write_text("mcp\n")
+        return (128, b"", b"") if "rev-parse" in cmd else (0, b"", b"")
+
+    bundle_path = tmp_path / "py.tar"
+    exporter = MCPPackageManager()
+    with patch.object(exporter, "_run", side_effect=fake_run):
+        exported = await exporter.export_bundle(str(bundle_path))
+    assert exported["wheels"] == 2
+    with tarfile.open(bundle_path) as tar:
+        assert sorted(n for n in tar.getnames() if n.startswith("wheels/")) == [
+            "wheels/anyio-4.0-py3-none-any.whl",
+            "wheels/mcp-1.0-py3-none-any.whl",
+        ]
+
+    # A fresh machine with a cold cache: the venv must build from the bundled wheels
+    shutil.rmtree(isolated_home / "repos")
+    shutil.rmtree(cache)
+    mcpm_module.INSTALLED_DB.write_text("{}")
+    seen = []
+
+    async def offline_venv(name, repo_path):
+        seen.append(sorted(p.name for p in cache.glob("*.whl")))
+        return {"venv": str(venv), "python": str(venv / "bin" / "python")}
+
+    importer = MCPPackageManager()
+    with patch.object(importer, "_run", side_effect=fake_run):
+        with patch.object(importer, "_build_venv", side_effect=offline_venv):
+            result = await importer.import_bundle(str(bundle_path), configure=False)
+    assert result["restored"] == ["py"] and result["wheels"] == 2
+    assert seen == [["anyio-4.0-py3-none-any.whl", "mcp-1.0-py3-none-any.whl"]]
+
+    # A venv that can't be built is an error, not a restored server
+    shutil.rmtree(isolated_home / "repos")
+    mcpm_module.INSTALLED_DB.write_text("{}")
+    importer = MCPPackageManager()
+    failed = AsyncMock(return_value={"venv_error": "No matching distribution found for mcp"})
+    with patch.object(importer, "_run", side_effect=fake_run):
+        with patch.object(importer, "_build_venv", failed):
+            result = await importer.import_bundle(str(bundle_path), configure=False)
+    assert result["restored"] == [] and "No matching distribution" in result["errors"]["py"]
+    assert "py" not in importer.installed
+
+
+@pytest.mark.asyncio
+async def test_listings_page_with_cursors(isolated_home):
+    """Test cursor paging visits every item once and the CLI-style slice"""
+    installed = {f"srv{i:02d}": {"method": "npm", "details": {}} for i in range(25)}
+    mcpm_module.INSTALLED_DB.write_text(json.dumps(installed))
+    manager = MCPPackageManager()
+
+    names, cursor, pages = [], None, 0
+    while True:
+        arguments = {"limit": 10} if cursor is None else {"limit": 10, "cursor": cursor}
+        response = await handle_request(
+            {"method": "tools/call", "params": {"name": "installed", "arguments": arguments}},
+            manager,
+        )
+        text = response["content"][0]["text"]
+        assert "\n" not in text
+        page = json.loads(text)
+        names += [s["name"] for s in page["items"]]
+        pages += 1
+        cursor = page.get("nextCursor")
+        if cursor is None:
+            break
+    assert pages == 3
+    assert names == sorted(installed)
+
+    response = await handle_request(
+        {"method": "tools/call", "params": {"name": "installed", "arguments": {"cursor": "bogus"}}},
+        manager,
+    )
+    assert "error" in json.loads(response["content"][0]["text"])
+
+    window = [s["name"] async for s in mcpm_module.aslice(manager.iter_installed(), 20, 3)]
+    assert window == ["srv20", "srv21", "srv22"]
+    # Unpaged calls keep returning the whole list
+    assert len(await manager.list_installed()) == 25
+
+
+@pytest.mark.asyncio
+async def test_scheduler_orders_by_priority_within_limits():
+    """Test interactive work jumps queued background work and backend limits hold"""
+    sched = scheduler.SubprocessScheduler(limit=2, backend_limits={"npm": 1})
+    gate = asyncio.Event()
+    order = []
+
+    async def job(label, backend, level):
+        async with sched.slot(backend, level):
+            order.append(label)
+            await gate.wait()
+
+    holders = [asyncio.create_task(job("first-npm", "npm", scheduler.BACKGROUND))]
+    await asyncio.sleep(0)
+    queued = [
+        asyncio.create_task(job("gc", "npm", scheduler.BACKGROUND)),
+        asyncio.create_task(job("sync", "npm", scheduler.BULK)),
+        asyncio.create_task(job("install", "npm", scheduler.INTERACTIVE)),
+        asyncio.create_task(job("clone", "git", scheduler.BACKGROUND)),
+    ]
+    await asyncio.sleep(0)
+    # git isn't stuck behind the saturated npm backend
+    assert order == ["first-npm", "clone"]
+    assert sched.metrics()["queue_depth"] == 3
+
+    gate.set()
+    await asyncio.gather(*holders, *queued)
+    assert order == ["first-npm", "clone", "install", "sync", "gc"]
+    metrics = sched.metrics()
+    assert metrics["queue_depth"] == 0 and metrics["peak_queue_depth"] == 3
+    assert metrics["waits"]["interactive"]["count"] == 1
+    assert metrics["running"] == {"npm": 0, "git": 0}
+
+
+@pytest.mark.asyncio
+async def test_scheduler_waits_reach_traces_and_logs(isolated_home, tmp_path, monkeypatch, caplog):
+    """Test a subprocess span carries its queue wait and slow waits are logged"""
+    trace = tmp_path / "trace.jsonl"
+    tracing.configure(str(trace))
+    try:
+        with scheduler.priority(scheduler.BULK):
+            await MCPPackageManager()._run(sys.executable, "-c", "pass")
+    finally:
+        tracing.shutdown()
+    event = next(e for e in tracing.to_chrome_trace(str(trace)) if e["name"] == "subprocess")
+    assert event["args"]["priority"] == "bulk" and event["args"]["queued_s"] >= 0
+
+    monkeypatch.setattr(scheduler, "SLOW_WAIT_S", 0.0)
+    sched = scheduler.SubprocessScheduler(limit=1)
+    with caplog.at_level("DEBUG", logger="mcpm.scheduler"):
+        async with sched.slot("npm"):
+            pass
+    assert "npm waited" in caplog.text and "interactive priority" in caplog.text
+
+
 @pytest.mark.asyncio
 async def test_list_installed_empty(mcpm):
     """Test listing installed packages when none are installed"""
@@ -194,6 +1200,92 @@ async def test_config_backup():
     assert result["backup"] == "/tmp/backup_20240101_120000"
 
 
+@pytest.mark.asyncio
+async def test_config_add_across_targets(isolated_home, tmp_path):
+    """Test config-add writes every selected target and reports per target"""
+    mcpm_module.INSTALLED_DB.write_text(
+        json.dumps({"memory": {"method": "npm", "details": {"method": "npm", "package": "@a/mem"}}})
+    )
+    profile = tmp_path / "profile" / "mcp.json"
+    assert ConfigTargets().register("work", str(profile))["status"] == "registered"
+
+    request = {
+        "method": "tools/call",
+        "params": {
+            "name": "config-add",
+            "arguments": {"name": "memory", "targets": ["claude-desktop", "work"]},
+        },
+    }
+    result = json.loads((await handle_request(request))["content"][0]["text"])
+
+    assert set(result) == {"claude-desktop", "work"}
+    assert all(r["status"] == "added" for r in result.values())
+    assert json.loads(profile.read_text())["mcpServers"]["memory"]["args"] == ["-y", "@a/mem"]
+    default = MCPConfigManager()
+    assert await default.get_server_config("memory") is not None
+    assert not list(profile.parent.glob(".mcp.json.*"))
+
+
+@pytest.mark.asyncio
+async def test_path_target_backups_stay_with_their_target(isolated_home, tmp_path):
+    """Test a path target backs up under a safe name and restores never cross targets"""
+    mcpm_module.INSTALLED_DB.write_text(
+        json.dumps({"memory": {"method": "npm", "details": {"method": "npm", "package": "@a/mem"}}})
+    )
+    project = tmp_path / "proj" / "mcp.json"
+    project.parent.mkdir()
+    project.write_text(json.dumps({"mcpServers": {"local": {"command": "x"}}}))
+    default = MCPConfigManager()
+    default.config = {"mcpServers": {"desktop": {"command": "y"}}}
+    await default.save_config()
+
+    request = {
+        "method": "tools/call",
+        "params": {"name": "config-add", "arguments": {"name": "memory", "targets": [str(project)]}},
+    }
+    result = json.loads((await handle_request(request))["content"][0]["text"])
+    assert result[str(project)]["status"] == "added"
+    assert set(json.loads(project.read_text())["mcpServers"]) == {"local", "memory"}
+
+    target = ConfigTargets().select([str(project)])[str(project)]
+    backups = await target.list_backups()
+    assert len(backups) == 1
+    assert Path(backups[0]["path"]).parent == target.backup_dir
+    assert await default.list_backups() == []
+
+    # The project backup can't be restored over the default config, and vice versa
+    refused = await default.restore_backup(backups[0]["path"])
+    assert "another config target" in refused["error"]
+    await default.backup_config()
+    default_backup = (await default.list_backups())[0]["path"]
+    assert "error" in await target.restore_backup(default_backup)
+    assert (await target.restore_backup(backups[0]["name"]))["status"] == "restored"
+    assert set(json.loads(project.read_text())["mcpServers"]) == {"local"}
+
+
+@pytest.mark.asyncio
+async def test_tracing_writes_chrome_events(isolated_home, tmp_path):
+    """Test --trace spans each phase and --profile dumps one file per request"""
+    assert tracing.span("idle") is tracing.span("also-idle")
+
+    trace = tmp_path / "trace.jsonl"
+    tracing.configure(str(trace), str(tmp_path / "profiles"))
+    try:
+        request = {"method": "tools/call", "params": {"name": "config-list", "arguments": {}}}
+        await handle_request(request)
+    finally:
+        tracing.shutdown()
+
+    events = tracing.to_chrome_trace(str(trace))
+    names = [e["name"] for e in events]
+    assert {"handle_request", "config.load", "encode_response"} <= set(names)
+    assert all(e["ph"] == "X" and e["dur"] >= 0 for e in events)
+    outer = events[names.index("handle_request")]
+    assert outer["args"] == {"method": "tools/call", "tool": "config-list"}
+    profiles = list((tmp_path / "profiles").iterdir())
+    assert len(profiles) == 1 and profiles[0].name.endswith("-tools_call-config-list.prof")
+
+
 def test_config_manager_initialization():
     """Test config manager initialization"""
     config_mgr = MCPConfigManager()
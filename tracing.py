@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+MCPM Tracing - Opt-in request tracing and profiling
+Copyright 2024 James Dominguez
+Licensed under the Apache License, Version 2.0
+
+Spans are written one Chrome trace event per line (JSONL). To load a trace
+in chrome://tracing or Perfetto, wrap it into an array:
+
+    python tracing.py trace.jsonl > trace.json
+
+When neither tracing nor profiling is configured every hook is a global
+lookup and a shared no-op context manager.
+"""
+
+import asyncio
+import contextlib
+import cProfile
+import functools
+import itertools
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Optional, TypeVar
+
+logger = logging.getLogger("mcpm.tracing")
+
+TRACE_ENV = "MCPM_TRACE"
+PROFILE_ENV = "MCPM_PROFILE"
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+_NOOP = contextlib.nullcontext()
+
+
+class Tracer:
+    """Appends Chrome trace events to a JSONL file"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a", buffering=1)
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._tids: dict[int, int] = {}
+
+    def _tid(self) -> int:
+        """One trace lane per asyncio task so concurrent spans don't interleave"""
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        key = id(task) if task else threading.get_ident()
+        return self._tids.setdefault(key, len(self._tids) + 1)
+
+    def complete(self, name: str, start_ns: int, end_ns: int, args: dict[str, Any]):
+        event = {
+            "name": name,
+            "cat": name.split(".", 1)[0],
+            "ph": "X",
+            "ts": start_ns // 1000,
+            "dur": (end_ns - start_ns) // 1000,
+            "pid": self._pid,
+            "tid": self._tid(),
+        }
+        if args:
+            event["args"] = args
+        line = json.dumps(event, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer: Tracer, name: str, args: dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.complete(self.name, self.start, time.perf_counter_ns(), self.args)
+        return False
+
+
+class _RequestProfile:
+    """cProfile one request and dump it as <dir>/<pid>-<seq>-<label>.prof"""
+
+    __slots__ = ("path", "profiler")
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.profiler = cProfile.Profile()
+
+    def __enter__(self):
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler.disable()
+        self.profiler.dump_stats(str(self.path))
+        return False
+
+
+_tracer: Optional[Tracer] = None
+_profile_dir: Optional[Path] = None
+_profile_seq = itertools.count(1)
+
+
+def configure(trace_path: Optional[str] = None, profile_dir: Optional[str] = None):
+    """Turn tracing and/or profiling on (falls back to MCPM_TRACE / MCPM_PROFILE)"""
+    global _tracer, _profile_dir
+    trace_path = trace_path or os.environ.get(TRACE_ENV)
+    profile_dir = profile_dir or os.environ.get(PROFILE_ENV)
+    if trace_path and _tracer is None:
+        _tracer = Tracer(Path(trace_path))
+        logger.info(f"Tracing to {_tracer.path}")
+    if profile_dir:
+        _profile_dir = Path(profile_dir)
+        _profile_dir.mkdir(parents=True, exist_ok=True)
+        logger.info(f"Profiling requests into {_profile_dir}")
+
+
+def shutdown():
+    """Flush and disable tracing and profiling"""
+    global _tracer, _profile_dir
+    if _tracer is not None:
+        _tracer.close()
+    _tracer = None
+    _profile_dir = None
+
+
+def span(name: str, **args: Any):
+    """Context manager timing a phase; free when tracing is off"""
+    if _tracer is None:
+        return _NOOP
+    return _Span(_tracer, name, args)
+
+
+def traced(name: str) -> Callable[[F], F]:
+    """Wrap an async function in a span named ``name``"""
+
+    def decorate(fn: F) -> F:
+        @functools.wraps(fn)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if _tracer is None:
+                return await fn(*args, **kwargs)
+            with _Span(_tracer, name, {}):
+                return await fn(*args, **kwargs)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorate
+
+
+def profile(label: str):
+    """Context manager capturing a cProfile dump for one request when enabled"""
+    if _profile_dir is None:
+        return _NOOP
+    safe = re.sub(r"[^A-Za-z0-9_.-]+", "_", label) or "request"
+    return _RequestProfile(_profile_dir / f"{os.getpid()}-{next(_profile_seq):05d}-{safe}.prof")
+
+
+def to_chrome_trace(jsonl_path: str) -> list[dict[str, Any]]:
+    """Read a JSONL trace back as the event array trace viewers expect"""
+    with open(jsonl_path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python tracing.py <trace.jsonl> > trace.json")
+        sys.exit(1)
+    json.dump(to_chrome_trace(sys.argv[1]), sys.stdout)
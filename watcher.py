@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+MCPM File Watcher - Notices external edits to the files MCPM caches
+Copyright 2024 James Dominguez
+Licensed under the Apache License, Version 2.0
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+import sys
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Callable, Optional
+
+logger = logging.getLogger("mcpm.watcher")
+
+# inotify(7) event bits we care about: content changes and atomic replaces
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+)
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def _load_inotify() -> Optional[ctypes.CDLL]:
+    """Return libc if it exposes inotify, otherwise None"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1  # noqa: B018 - probe for the symbol
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class FileWatcher:
+    """Watch a set of files and report changes in debounced batches
+
+    Uses inotify on the files' parent directories where available, so atomic
+    replace-by-rename writes are seen, and falls back to stat polling
+    elsewhere (or for files whose directory does not exist yet). ``callback``
+    receives the set of changed paths once events have been quiet for
+    ``debounce`` seconds.
+    """
+
+    def __init__(
+        self,
+        paths: Iterable[Path],
+        callback: Callable[[set[Path]], None],
+        debounce: float = 0.2,
+        poll_interval: float = 2.0,
+        use_inotify: Optional[bool] = None,
+    ):
+        self.paths = {Path(p).absolute() for p in paths if p}
+        self.callback = callback
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.backend = "none"
+        self._pending: set[Path] = set()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._fd: Optional[int] = None
+        self._watches: dict[int, tuple[Path, set[str]]] = {}
+        self._poll_task: Optional[asyncio.Task] = None
+        self._polled: dict[Path, Optional[tuple[int, int, int]]] = {}
+
+    def start(self):
+        """Begin watching; must be called from within the running loop"""
+        self._loop = asyncio.get_running_loop()
+        remaining = set(self.paths)
+        libc = _load_inotify() if self.use_inotify is not False else None
+        if libc is not None:
+            remaining = self._start_inotify(libc, remaining)
+        if remaining:
+            self._polled = {path: self._stat(path) for path in remaining}
+            self._poll_task = self._loop.create_task(self._poll())
+        if self._fd is not None and remaining:
+            self.backend = "inotify+poll"
+        elif self._fd is not None:
+            self.backend = "inotify"
+        elif remaining:
+            self.backend = "poll"
+        logger.info(f"Watching {len(self.paths)} paths via {self.backend}")
+
+    def stop(self):
+        """Stop watching and drop any pending batch"""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if self._poll_task:
+            self._poll_task.cancel()
+            self._poll_task = None
+        if self._fd is not None:
+            if self._loop:
+                self._loop.remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
+        self._watches.clear()
+        self._pending.clear()
+
+    def _start_inotify(self, libc: ctypes.CDLL, paths: set[Path]) -> set[Path]:
+        """Watch parent directories via inotify, returning paths left for polling"""
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            logger.debug(f"inotify_init1 failed: {os.strerror(ctypes.get_errno())}")
+            return paths
+
+        by_dir: dict[Path, set[str]] = {}
+        for path in paths:
+            by_dir.setdefault(path.parent, set()).add(path.name)
+
+        remaining = set()
+        for directory, names in by_dir.items():
+            wd = libc.inotify_add_watch(fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                remaining.update(directory / name for name in names)
+                continue
+            self._watches[wd] = (directory, names)
+
+        if not self._watches:
+            os.close(fd)
+            return paths
+        self._fd = fd
+        self._loop.add_reader(fd, self._read_events)
+        return remaining
+
+    def _read_events(self):
+        """Drain the inotify fd and queue matching paths"""
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0").decode(errors="replace")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # Lost events; assume everything changed
+                self._queue(self.paths)
+                continue
+            watch = self._watches.get(wd)
+            if watch and name in watch[1]:
+                self._queue([watch[0] / name])
+
+    @staticmethod
+    def _stat(path: Path) -> Optional[tuple[int, int, int]]:
+        try:
+            st = path.stat()
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    async def _poll(self):
+        """Fallback: compare stat signatures on a fixed interval"""
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            changed = []
+            for path, previous in self._polled.items():
+                current = self._stat(path)
+                if current != previous:
+                    self._polled[path] = current
+                    changed.append(path)
+            if changed:
+                self._queue(changed)
+
+    def _queue(self, paths: Iterable[Path]):
+        """Add paths to the pending batch and (re)arm the debounce timer"""
+        self._pending.update(paths)
+        if self._timer:
+            self._timer.cancel()
+        self._timer = self._loop.call_later(self.debounce, self._flush)
+
+    def _flush(self):
+        self._timer = None
+        changed, self._pending = self._pending, set()
+        if not changed:
+            return
+        try:
+            self.callback(changed)
+        except Exception as e:
+            logger.error(f"Watch callback failed: {e}")